@@ -1,9 +1,29 @@
-from flask import Flask, render_template_string, request, redirect, session, send_from_directory, g
+from flask import Flask, render_template_string, request, redirect, session, send_from_directory, g, Response, stream_with_context, jsonify
+from markupsafe import Markup
 import sqlite3
 import os
+import io
+import json
+import base64
+import hashlib
+import mimetypes
+import shutil
+import threading
+import zipfile
+import zlib
+import calendar
+import queue
+import click
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 import uuid
+import time
 import random
 import smtplib
+try:
+    import fcntl
+except ImportError:  # not available on Windows; backups then only guard against this process
+    fcntl = None
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from email.mime.text import MIMEText
@@ -16,6 +36,18 @@ from email.mime.text import MIMEText
 import os
 from email.mime.multipart import MIMEMultipart
 
+import repository
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it photos are stored as uploaded
+    Image = None
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; responses then fall back to gzip
+    brotli = None
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'supersecretkey123!@#')
 
@@ -40,11 +72,21 @@ otp_storage = {}
 
 # ---------------- DATABASE CONNECTION ----------------
 
+# How long a connection waits on another process's write lock before giving up with "database is locked"
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))
+
+def connect_db(isolation_level=""):
+    """A connection with the settings every part of the app expects"""
+    db = sqlite3.connect(DATABASE, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=isolation_level)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA foreign_keys = ON")
+    # Safe with WAL: a power cut can lose the last commits but never corrupt the database
+    db.execute("PRAGMA synchronous = NORMAL")
+    return db
+
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
-        g.db.execute("PRAGMA foreign_keys = ON")
+        g.db = connect_db()
     return g.db
 
 @app.teardown_appcontext
@@ -53,13 +95,156 @@ def close_db(exception):
     if db is not None:
         db.close()
 
+# ---------------- WRITE QUEUE ----------------
+
+# Request writes in a process go through one writer thread, so they never contend with each other
+# for SQLite's write lock; only the other worker processes remain, and BEGIN IMMEDIATE plus the busy
+# timeout and backoff below absorb those
+WRITE_GROUP_MAX = int(os.environ.get('WRITE_GROUP_MAX', 32))
+WRITE_RETRIES = int(os.environ.get('WRITE_RETRIES', 8))
+# How long a request waits for its write before giving up
+WRITE_TIMEOUT_SECONDS = float(os.environ.get('WRITE_TIMEOUT_SECONDS', 30))
+
+def is_busy_error(error):
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+class WriteQueue:
+    """Runs write functions one after another on a private connection, several per commit
+    
+    Each queued function gets its own savepoint, so one failing write rolls back alone
+    while the rest of its group still commits.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = None
+        self.pid = None
+        self.thread = None
+    
+    def submit(self, fn, *args):
+        """Run fn(db, *args) inside a write transaction and return its result once committed"""
+        self._ensure_running()
+        future = Future()
+        self.jobs.put((fn, args, future))
+        try:
+            return future.result(timeout=WRITE_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            # Still queued: cancelling it means it can never commit after the caller has given up
+            if future.cancel():
+                raise
+            # Already running, and every group resolves its futures one way or another
+            return future.result(timeout=WRITE_TIMEOUT_SECONDS)
+    
+    def depth(self):
+        return self.jobs.qsize() if self.jobs is not None else 0
+    
+    def _ensure_running(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own writer
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.jobs = queue.Queue()
+                self.thread = None
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, args=(self.jobs,), daemon=True)
+                self.thread.start()
+    
+    def _run(self, jobs):
+        db = connect_db(isolation_level=None)
+        while True:
+            group = [jobs.get()]
+            # Whatever queued up while the last group was committing rides along in this one
+            while len(group) < WRITE_GROUP_MAX:
+                try:
+                    group.append(jobs.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit_group(db, group)
+            except Exception as e:
+                # None of the group was committed; every caller hears so, and the writer carries
+                # on with a fresh connection in case this one is what broke
+                print(f"Write group failed: {e}")
+                for _, _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                try:
+                    if db.in_transaction:
+                        db.rollback()
+                    db.close()
+                except sqlite3.Error:
+                    pass
+                db = connect_db(isolation_level=None)
+    
+    def _begin(self, db):
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == WRITE_RETRIES:
+                    raise
+                print(f"Write lock busy, retrying (attempt {attempt + 1})")
+                time.sleep(min(0.05 * 2 ** attempt, 2) * random.uniform(0.5, 1.5))
+    
+    def _commit_group(self, db, group):
+        try:
+            self._begin(db)
+        except Exception as e:
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        results = []
+        for fn, args, future in group:
+            # Cancelled by a caller that timed out before its turn came
+            if not future.set_running_or_notify_cancel():
+                continue
+            db.execute("SAVEPOINT write_job")
+            try:
+                result = fn(db, *args)
+                db.execute("RELEASE write_job")
+                results.append((future, result, None))
+            except Exception as e:
+                # SQLite itself rolls the whole transaction back on some errors (disk full, I/O
+                # errors), taking the jobs before this one with it: the group fails as a whole
+                if not db.in_transaction:
+                    raise
+                db.execute("ROLLBACK TO write_job")
+                db.execute("RELEASE write_job")
+                results.append((future, None, e))
+        
+        try:
+            db.execute("COMMIT")
+        except Exception as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            for future, _, _ in results:
+                future.set_exception(e)
+            return
+        
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+writer = WriteQueue()
+
+def run_write(fn, *args):
+    """Run fn(db, *args) through this process's write queue; exceptions from fn are re-raised here"""
+    return writer.submit(fn, *args)
+
 # ---------------- INIT DATABASE (WITHOUT OVERWRITING) ----------------
 
 def init_db():
     """Initialize database only if it doesn't exist - won't overwrite existing data"""
     db_exists = os.path.exists(DATABASE)
-    db = sqlite3.connect(DATABASE)
+    db = sqlite3.connect(DATABASE, timeout=SQLITE_BUSY_TIMEOUT)
     db.execute("PRAGMA foreign_keys = ON")
+    # WAL lets readers carry on while a write is in progress (the setting is stored in the file)
+    db.execute("PRAGMA journal_mode = WAL")
     
     # Check if tables exist
     cursor = db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
@@ -96,16 +281,14 @@ def init_db():
         """)
 
         # Create admin user only if no users exist
-        admin_exists = db.execute("SELECT * FROM users WHERE username = 'admin'").fetchone()
+        admin_exists = repository.get_user_by_username(db, "admin")
         if not admin_exists:
-            db.execute("INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
-                       ("admin", generate_password_hash("admin123"), "admin@diary.com"))
+            repository.create_user(db, "admin", generate_password_hash("admin123"), "admin@diary.com")
         
         # Create test user only if no test user exists
-        test_exists = db.execute("SELECT * FROM users WHERE username = 'test'").fetchone()
+        test_exists = repository.get_user_by_username(db, "test")
         if not test_exists:
-            db.execute("INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
-                       ("test", generate_password_hash("test123"), "test@example.com"))
+            repository.create_user(db, "test", generate_password_hash("test123"), "test@example.com")
         
         db.commit()
         print("Database initialized successfully!")
@@ -113,23 +296,328 @@ def init_db():
         print("Database already exists, skipping initialization...")
         
         # Check if admin exists, if not create it
-        admin_exists = db.execute("SELECT * FROM users WHERE username = 'admin'").fetchone()
+        admin_exists = repository.get_user_by_username(db, "admin")
         if not admin_exists:
             print("Admin user not found, creating...")
-            db.execute("INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
-                       ("admin", generate_password_hash("admin123"), "admin@diary.com"))
+            repository.create_user(db, "admin", generate_password_hash("admin123"), "admin@diary.com")
             db.commit()
         
         # Check if test user exists, if not create it
-        test_exists = db.execute("SELECT * FROM users WHERE username = 'test'").fetchone()
+        test_exists = repository.get_user_by_username(db, "test")
         if not test_exists:
             print("Test user not found, creating...")
-            db.execute("INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
-                       ("test", generate_password_hash("test123"), "test@example.com"))
+            repository.create_user(db, "test", generate_password_hash("test123"), "test@example.com")
             db.commit()
     
+    # Bring older databases up to the current schema
+    migrate_db(db)
+    prune_tombstones(db)
+    prune_stale_drafts(db)
+    prune_old_revisions(db)
+    backfill_photo_sizes(db)
+    backfill_entry_stats(db)
+    
     db.close()
 
+# ---------------- SCHEMA MIGRATIONS ----------------
+
+# Each entry upgrades the schema by one version (tracked in PRAGMA user_version).
+# Only ever append to this list - never edit a migration that has shipped.
+SCHEMA_MIGRATIONS = [
+    # 1: resumable bulk imports
+    """
+    ALTER TABLE entries ADD COLUMN source_ref TEXT;
+    CREATE UNIQUE INDEX idx_entries_source_ref ON entries(user_id, source_ref) WHERE source_ref IS NOT NULL;
+
+    CREATE TABLE imports(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        archive_path TEXT NOT NULL,
+        original_name TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        lines_done INTEGER NOT NULL DEFAULT 0,
+        entries_imported INTEGER NOT NULL DEFAULT 0,
+        photos_imported INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    """,
+    # 2: change log for delta sync - one row per object holding its latest change
+    """
+    CREATE TABLE changes(
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        object_id INTEGER NOT NULL,
+        entry_id INTEGER,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE UNIQUE INDEX idx_changes_object ON changes(kind, object_id);
+    CREATE INDEX idx_changes_user_seq ON changes(user_id, seq);
+
+    CREATE TABLE sync_meta(
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+
+    -- REPLACE drops the object's previous change row, so each write gets a fresh, higher seq
+    CREATE TRIGGER entries_sync_insert AFTER INSERT ON entries BEGIN
+        INSERT OR REPLACE INTO changes (user_id, kind, object_id, entry_id)
+        VALUES (NEW.user_id, 'entry', NEW.id, NEW.id);
+    END;
+
+    CREATE TRIGGER entries_sync_update AFTER UPDATE OF date, content ON entries BEGIN
+        INSERT OR REPLACE INTO changes (user_id, kind, object_id, entry_id)
+        VALUES (NEW.user_id, 'entry', NEW.id, NEW.id);
+    END;
+
+    -- An entry tombstone stands for its photos too
+    CREATE TRIGGER entries_sync_delete AFTER DELETE ON entries BEGIN
+        DELETE FROM changes WHERE kind = 'photo' AND entry_id = OLD.id;
+        INSERT OR REPLACE INTO changes (user_id, kind, object_id, entry_id, deleted)
+        VALUES (OLD.user_id, 'entry', OLD.id, OLD.id, 1);
+    END;
+
+    CREATE TRIGGER photos_sync_insert AFTER INSERT ON photos BEGIN
+        INSERT OR REPLACE INTO changes (user_id, kind, object_id, entry_id)
+        SELECT e.user_id, 'photo', NEW.id, NEW.entry_id FROM entries e WHERE e.id = NEW.entry_id;
+    END;
+
+    -- Photos removed by an entry cascade find no entry here; the entry tombstone covers them
+    CREATE TRIGGER photos_sync_delete AFTER DELETE ON photos BEGIN
+        INSERT OR REPLACE INTO changes (user_id, kind, object_id, entry_id, deleted)
+        SELECT e.user_id, 'photo', OLD.id, OLD.entry_id, 1 FROM entries e WHERE e.id = OLD.entry_id;
+    END;
+
+    CREATE TRIGGER users_sync_delete AFTER DELETE ON users BEGIN
+        DELETE FROM changes WHERE user_id = OLD.id;
+    END;
+
+    INSERT INTO changes (user_id, kind, object_id, entry_id)
+    SELECT user_id, 'entry', id, id FROM entries ORDER BY id;
+    INSERT INTO changes (user_id, kind, object_id, entry_id)
+    SELECT e.user_id, 'photo', p.id, p.entry_id FROM photos p JOIN entries e ON e.id = p.entry_id ORDER BY p.id;
+    """,
+    # 3: per-user generation for the cached entries list
+    """
+    ALTER TABLE users ADD COLUMN entries_generation INTEGER NOT NULL DEFAULT 0;
+    """,
+    # 4: per-user aggregates and indexes for the admin user directory
+    """
+    ALTER TABLE users ADD COLUMN entry_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE users ADD COLUMN photo_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE users ADD COLUMN storage_bytes INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE photos ADD COLUMN size_bytes INTEGER;
+
+    CREATE INDEX idx_users_created_at ON users(created_at);
+    CREATE INDEX idx_users_entry_count ON users(entry_count);
+    CREATE INDEX idx_users_storage_bytes ON users(storage_bytes);
+    CREATE INDEX idx_users_username_nocase ON users(username COLLATE NOCASE);
+    CREATE INDEX idx_users_email_nocase ON users(email COLLATE NOCASE);
+    CREATE INDEX idx_photos_unsized ON photos(id) WHERE size_bytes IS NULL;
+
+    CREATE TRIGGER entries_stats_insert AFTER INSERT ON entries BEGIN
+        UPDATE users SET entry_count = entry_count + 1 WHERE id = NEW.user_id;
+    END;
+
+    -- Runs before the cascade removes the photos, so they can still be counted here
+    CREATE TRIGGER entries_stats_delete BEFORE DELETE ON entries BEGIN
+        UPDATE users
+        SET entry_count = entry_count - 1,
+            photo_count = photo_count - (SELECT COUNT(*) FROM photos WHERE entry_id = OLD.id),
+            storage_bytes = storage_bytes - (SELECT COALESCE(SUM(size_bytes), 0) FROM photos WHERE entry_id = OLD.id)
+        WHERE id = OLD.user_id;
+    END;
+
+    CREATE TRIGGER photos_stats_insert AFTER INSERT ON photos BEGIN
+        UPDATE users
+        SET photo_count = photo_count + 1,
+            storage_bytes = storage_bytes + COALESCE(NEW.size_bytes, 0)
+        WHERE id = (SELECT user_id FROM entries WHERE id = NEW.entry_id);
+    END;
+
+    CREATE TRIGGER photos_stats_resize AFTER UPDATE OF size_bytes ON photos BEGIN
+        UPDATE users
+        SET storage_bytes = storage_bytes + COALESCE(NEW.size_bytes, 0) - COALESCE(OLD.size_bytes, 0)
+        WHERE id = (SELECT user_id FROM entries WHERE id = NEW.entry_id);
+    END;
+
+    -- Photos removed by an entry cascade were already subtracted by entries_stats_delete
+    CREATE TRIGGER photos_stats_delete AFTER DELETE ON photos BEGIN
+        UPDATE users
+        SET photo_count = photo_count - 1,
+            storage_bytes = storage_bytes - COALESCE(OLD.size_bytes, 0)
+        WHERE id = (SELECT user_id FROM entries WHERE id = OLD.entry_id);
+    END;
+
+    UPDATE users SET
+        entry_count = (SELECT COUNT(*) FROM entries WHERE user_id = users.id),
+        photo_count = (SELECT COUNT(*) FROM photos p JOIN entries e ON p.entry_id = e.id WHERE e.user_id = users.id);
+    """,
+    # 5: precomputed list columns, so listing a diary never reads entry bodies
+    """
+    ALTER TABLE entries ADD COLUMN preview TEXT;
+    ALTER TABLE entries ADD COLUMN word_count INTEGER;
+    ALTER TABLE entries ADD COLUMN char_count INTEGER;
+
+    -- Covers the entries list (id is the rowid); filled in by backfill_entry_stats() on startup
+    CREATE INDEX idx_entries_list ON entries(user_id, date, created_at, id, preview, word_count, char_count);
+    CREATE INDEX idx_entries_unstatted ON entries(id) WHERE word_count IS NULL;
+    """,
+    # 6: photo dimensions and a tiny inline placeholder, computed once at upload
+    """
+    ALTER TABLE photos ADD COLUMN width INTEGER;
+    ALTER TABLE photos ADD COLUMN height INTEGER;
+    ALTER TABLE photos ADD COLUMN placeholder TEXT;
+    CREATE INDEX idx_photos_unpreviewed ON photos(id) WHERE width IS NULL;
+    """,
+    # 7: soft-deleted accounts waiting for the background purge
+    """
+    ALTER TABLE users ADD COLUMN deleted_at TIMESTAMP;
+    CREATE INDEX idx_users_deleted ON users(id) WHERE deleted_at IS NOT NULL;
+    """,
+    # 8: per-entry version for optimistic concurrency on updates
+    """
+    ALTER TABLE entries ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
+    """,
+    # 9: autosaved drafts - kept apart from entries so autosaves skip the entry triggers and caches
+    """
+    CREATE TABLE drafts(
+        user_id INTEGER NOT NULL,
+        entry_id INTEGER NOT NULL DEFAULT 0,
+        base_version INTEGER,
+        date TEXT,
+        content TEXT NOT NULL DEFAULT '',
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, entry_id),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    CREATE INDEX idx_drafts_updated_at ON drafts(updated_at);
+
+    CREATE TRIGGER entries_drafts_delete AFTER DELETE ON entries BEGIN
+        DELETE FROM drafts WHERE user_id = OLD.user_id AND entry_id = OLD.id;
+    END;
+    """,
+    # 10: revision history - the text each edit replaced, as a compressed delta or snapshot
+    """
+    CREATE TABLE entry_revisions(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        entry_id INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        word_count INTEGER NOT NULL,
+        is_snapshot INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(entry_id) REFERENCES entries(id) ON DELETE CASCADE
+    );
+    CREATE UNIQUE INDEX idx_entry_revisions_version ON entry_revisions(entry_id, version);
+    CREATE INDEX idx_entry_revisions_saved_at ON entry_revisions(saved_at);
+    """,
+    # 11: import jobs claimed through a heartbeat; imported photos keyed by their archive name
+    """
+    ALTER TABLE imports ADD COLUMN heartbeat TIMESTAMP;
+    ALTER TABLE photos ADD COLUMN source_name TEXT;
+    CREATE UNIQUE INDEX idx_photos_source_name ON photos(entry_id, source_name) WHERE source_name IS NOT NULL;
+    """,
+    # 12: a user's entries in id order (exports stream straight off it) and an entry's photos
+    """
+    CREATE INDEX idx_entries_user ON entries(user_id);
+    CREATE INDEX idx_photos_entry ON photos(entry_id);
+    """,
+    # 13: pad dates saved with years before 1000 ('999-01-01') to four digits, so they sort
+    """
+    UPDATE entries SET date = substr('000' || date, -10)
+    WHERE length(date) BETWEEN 7 AND 9 AND date GLOB '*[0-9]-[0-9][0-9]-[0-9][0-9]';
+    """,
+]
+
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+def split_statements(script):
+    """The SQL statements of a migration script, trigger bodies kept whole"""
+    statements = []
+    current = ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    return statements
+
+def migrate_db(db):
+    """Apply any migrations the database hasn't seen yet
+    
+    Every worker runs this at startup, so each migration re-reads user_version under the write
+    lock and is skipped if another process got there first.
+    """
+    while db.execute("PRAGMA user_version").fetchone()[0] < len(SCHEMA_MIGRATIONS):
+        try:
+            db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e):
+                raise
+            print("Waiting for another process to finish migrating...")
+            continue
+        try:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(SCHEMA_MIGRATIONS):
+                print(f"Applying schema migration {version + 1}...")
+                for statement in split_statements(SCHEMA_MIGRATIONS[version]):
+                    db.execute(statement)
+                db.execute(f"PRAGMA user_version = {version + 1}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 90))
+
+def prune_tombstones(db):
+    """Forget deletions older than SYNC_TOMBSTONE_DAYS; clients whose cursor is older must resync from scratch"""
+    if repository.prune_tombstones(db, SYNC_TOMBSTONE_DAYS):
+        db.commit()
+
+DRAFT_MAX_AGE_DAYS = int(os.environ.get('DRAFT_MAX_AGE_DAYS', 30))
+
+def prune_stale_drafts(db):
+    """Drop autosaved drafts nobody has touched for DRAFT_MAX_AGE_DAYS"""
+    if repository.delete_stale_drafts(db, DRAFT_MAX_AGE_DAYS):
+        db.commit()
+
+# Revisions older than this go at startup (0 keeps them until REVISION_KEEP pushes them out)
+REVISION_MAX_AGE_DAYS = int(os.environ.get('REVISION_MAX_AGE_DAYS', 365))
+
+def prune_old_revisions(db):
+    if REVISION_MAX_AGE_DAYS and repository.delete_old_revisions(db, REVISION_MAX_AGE_DAYS):
+        db.commit()
+
+def backfill_photo_sizes(db):
+    """Record the file size of photos uploaded before sizes were tracked"""
+    while True:
+        rows = repository.get_unsized_photos(db, 500)
+        if not rows:
+            break
+        sizes = []
+        for photo_id, filename in rows:
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            sizes.append((os.path.getsize(filepath) if os.path.isfile(filepath) else 0, photo_id))
+        repository.set_photo_sizes(db, sizes)
+        db.commit()
+
+def backfill_entry_stats(db):
+    """Fill preview/word_count/char_count for entries written before those columns existed"""
+    while True:
+        rows = repository.get_unstatted_entries(db, 500)
+        if not rows:
+            break
+        repository.set_entry_stats(db, [repository.entry_stats(content) + (entry_id,) for entry_id, content in rows])
+        db.commit()
+
 # Initialize database
 init_db()
 
@@ -178,45 +666,9 @@ LOGIN_TEMPLATE = """
 <head>
 <title>Login - Personal Diary</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-*{margin:0;padding:0;box-sizing:border-box;font-family:'Poppins',sans-serif;}
-body{background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh;display:flex;align-items:center;justify-content:center;padding:20px;}
-.login-card{width:100%;max-width:400px;background:white;padding:40px;border-radius:20px;box-shadow:0 20px 40px rgba(0,0,0,0.2);}
-h2{text-align:center;color:#333;margin-bottom:30px;font-size:28px;}
-.tabs{display:flex;margin-bottom:30px;border-bottom:2px solid #eee;}
-.tab{flex:1;text-align:center;padding:10px;cursor:pointer;color:#666;transition:all 0.3s;font-weight:500;}
-.tab.active{color:#667eea;border-bottom:2px solid #667eea;margin-bottom:-2px;}
-.form-container{padding:20px 0;}
-.form-group{margin-bottom:20px;}
-label{display:block;margin-bottom:5px;color:#555;font-weight:500;}
-input{width:100%;padding:12px;border:2px solid #e0e0e0;border-radius:10px;font-size:14px;transition:all 0.3s;}
-input:focus{outline:none;border-color:#667eea;}
-button{width:100%;padding:14px;background:#667eea;color:white;border:none;border-radius:10px;font-size:16px;font-weight:600;cursor:pointer;transition:all 0.3s;}
-button:hover{background:#5a67d8;transform:translateY(-2px);box-shadow:0 5px 15px rgba(102,126,234,0.4);}
-button.signup-btn{background:#48bb78;}
-button.signup-btn:hover{background:#38a169;}
-button.forgot-btn{background:#f6ad55;margin-top:10px;}
-.message{padding:12px;border-radius:8px;margin-bottom:20px;text-align:center;}
-.success{background:#c6f6d5;color:#22543d;border:1px solid #9ae6b4;}
-.error{background:#fed7d7;color:#742a2a;border:1px solid #feb2b2;}
-.switch-text{text-align:center;margin-top:20px;color:#666;}
-.switch-text span{color:#667eea;cursor:pointer;font-weight:600;}
-.switch-text span:hover{text-decoration:underline;}
-.info-box{background:#e6f7ff;border:1px solid #91d5ff;padding:10px;border-radius:8px;margin-bottom:20px;text-align:center;color:#0050b3;}
-.info-box strong{color:#1890ff;}
-.forgot-link{text-align:center;margin-top:15px;}
-.forgot-link a{color:#667eea;text-decoration:none;font-size:14px;}
-.forgot-link a:hover{text-decoration:underline;}
-
-/* Mobile Responsive */
-@media(max-width:480px){
-    .login-card{padding:25px;}
-    h2{font-size:24px;}
-    .tab{padding:8px;}
-    button{padding:12px;}
-}
-</style>
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/login.css') }}">
 </head>
 <body>
 <div class="login-card">
@@ -275,21 +727,7 @@ button.forgot-btn{background:#f6ad55;margin-top:10px;}
     </div>
 </div>
 
-<script>
-function showLogin() {
-    document.getElementById('login-form').style.display = 'block';
-    document.getElementById('signup-form').style.display = 'none';
-    document.querySelectorAll('.tab')[0].classList.add('active');
-    document.querySelectorAll('.tab')[1].classList.remove('active');
-}
-
-function showSignup() {
-    document.getElementById('login-form').style.display = 'none';
-    document.getElementById('signup-form').style.display = 'block';
-    document.querySelectorAll('.tab')[0].classList.remove('active');
-    document.querySelectorAll('.tab')[1].classList.add('active');
-}
-</script>
+<script src="{{ asset_url('js/login.js') }}"></script>
 </body>
 </html>
 """
@@ -302,148 +740,9 @@ FORGOT_PASSWORD_PAGE = """
 <head>
 <title>Forgot Password</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
-
-body {
-    background: linear-gradient(135deg, #667eea, #764ba2);
-    min-height: 100vh;
-    display: flex;
-    align-items: center;
-    justify-content: center;
-    padding: 20px;
-}
-
-.card {
-    background: white;
-    border-radius: 20px;
-    padding: 40px;
-    box-shadow: 0 20px 40px rgba(0,0,0,0.2);
-    max-width: 400px;
-    width: 100%;
-}
-
-.card h2 {
-    color: #333;
-    margin-bottom: 10px;
-    font-size: 24px;
-    text-align: center;
-}
-
-.card p {
-    color: #666;
-    margin-bottom: 30px;
-    text-align: center;
-    font-size: 14px;
-}
-
-.form-group {
-    margin-bottom: 20px;
-}
-
-label {
-    display: block;
-    margin-bottom: 8px;
-    color: #555;
-    font-weight: 500;
-    font-size: 14px;
-}
-
-input {
-    width: 100%;
-    padding: 12px;
-    border: 2px solid #e0e0e0;
-    border-radius: 10px;
-    font-size: 14px;
-    transition: all 0.3s;
-}
-
-input:focus {
-    outline: none;
-    border-color: #667eea;
-}
-
-button {
-    width: 100%;
-    padding: 14px;
-    background: #667eea;
-    color: white;
-    border: none;
-    border-radius: 10px;
-    font-size: 16px;
-    font-weight: 600;
-    cursor: pointer;
-    transition: all 0.3s;
-    margin-bottom: 10px;
-}
-
-button:hover {
-    background: #5a67d8;
-    transform: translateY(-2px);
-    box-shadow: 0 5px 15px rgba(102,126,234,0.4);
-}
-
-button.secondary {
-    background: #48bb78;
-}
-
-button.secondary:hover {
-    background: #38a169;
-}
-
-.back-link {
-    text-align: center;
-    margin-top: 20px;
-}
-
-.back-link a {
-    color: #667eea;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-.back-link a:hover {
-    text-decoration: underline;
-}
-
-.message {
-    padding: 12px;
-    border-radius: 8px;
-    margin-bottom: 20px;
-    text-align: center;
-}
-
-.success {
-    background: #c6f6d5;
-    color: #22543d;
-    border: 1px solid #9ae6b4;
-}
-
-.error {
-    background: #fed7d7;
-    color: #742a2a;
-    border: 1px solid #feb2b2;
-}
-
-.otp-input {
-    letter-spacing: 8px;
-    font-size: 20px;
-    text-align: center;
-}
-
-.timer {
-    text-align: center;
-    color: #666;
-    font-size: 14px;
-    margin-top: 10px;
-}
-</style>
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/forgot-password.css') }}">
 </head>
 <body>
 
@@ -514,127 +813,9 @@ CHANGE_PASSWORD_PAGE = """
 <head>
 <title>Change Password</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
-
-body {
-    background: linear-gradient(135deg, #667eea, #764ba2);
-    min-height: 100vh;
-    padding: 20px;
-}
-
-.header {
-    background: rgba(0, 0, 0, 0.7);
-    color: white;
-    padding: 15px 20px;
-    border-radius: 15px;
-    margin-bottom: 20px;
-    display: flex;
-    align-items: center;
-    gap: 15px;
-}
-
-.back-btn {
-    background: #667eea;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-.header h3 {
-    font-size: 18px;
-    flex: 1;
-}
-
-.form-container {
-    background: white;
-    border-radius: 15px;
-    padding: 30px;
-    max-width: 400px;
-    margin: 0 auto;
-    box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-}
-
-.form-container h2 {
-    color: #333;
-    margin-bottom: 20px;
-    font-size: 22px;
-    text-align: center;
-}
-
-.form-group {
-    margin-bottom: 20px;
-}
-
-label {
-    display: block;
-    margin-bottom: 8px;
-    color: #555;
-    font-weight: 500;
-}
-
-input {
-    width: 100%;
-    padding: 12px;
-    border: 2px solid #e0e0e0;
-    border-radius: 10px;
-    font-size: 14px;
-}
-
-input:focus {
-    outline: none;
-    border-color: #667eea;
-}
-
-button {
-    width: 100%;
-    padding: 14px;
-    background: #667eea;
-    color: white;
-    border: none;
-    border-radius: 10px;
-    font-size: 16px;
-    font-weight: 600;
-    cursor: pointer;
-    transition: all 0.3s;
-    margin-top: 10px;
-}
-
-button:hover {
-    background: #5a67d8;
-    transform: translateY(-2px);
-    box-shadow: 0 5px 15px rgba(102,126,234,0.4);
-}
-
-.message {
-    padding: 12px;
-    border-radius: 8px;
-    margin-bottom: 20px;
-    text-align: center;
-}
-
-.success {
-    background: #c6f6d5;
-    color: #22543d;
-    border: 1px solid #9ae6b4;
-}
-
-.error {
-    background: #fed7d7;
-    color: #742a2a;
-    border: 1px solid #feb2b2;
-}
-</style>
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/change-password.css') }}">
 </head>
 <body>
 
@@ -679,403 +860,9 @@ ADMIN_PANEL_PAGE = """
 <head>
 <title>Admin Panel - User Management</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
-
-body {
-    background: linear-gradient(135deg, #667eea, #764ba2);
-    min-height: 100vh;
-    padding: 20px;
-    padding-bottom: 80px;
-}
-
-.header {
-    background: rgba(0, 0, 0, 0.7);
-    color: white;
-    padding: 15px 20px;
-    border-radius: 15px;
-    margin-bottom: 20px;
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-    flex-wrap: wrap;
-    gap: 10px;
-}
-
-.header h3 {
-    font-size: 18px;
-}
-
-.admin-badge {
-    background: #f6ad55;
-    color: white;
-    padding: 5px 10px;
-    border-radius: 20px;
-    font-size: 12px;
-    font-weight: 600;
-}
-
-.logout-btn {
-    background: #f56565;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-.stats-container {
-    background: rgba(255, 255, 255, 0.15);
-    backdrop-filter: blur(15px);
-    border-radius: 15px;
-    padding: 20px;
-    color: white;
-    margin-bottom: 20px;
-}
-
-.stats-title {
-    margin-bottom: 15px;
-    font-size: 20px;
-    display: flex;
-    align-items: center;
-    gap: 10px;
-}
-
-.stats-grid {
-    display: grid;
-    grid-template-columns: repeat(auto-fit, minmax(120px, 1fr));
-    gap: 15px;
-    margin-bottom: 20px;
-}
-
-.stat-card {
-    background: rgba(255, 255, 255, 0.2);
-    padding: 15px;
-    border-radius: 12px;
-    text-align: center;
-}
-
-.stat-number {
-    font-size: 24px;
-    font-weight: 600;
-    margin-bottom: 5px;
-}
-
-.stat-label {
-    font-size: 12px;
-    opacity: 0.8;
-}
-
-.search-container {
-    margin-bottom: 20px;
-}
-
-.search-box {
-    width: 100%;
-    padding: 15px;
-    border: none;
-    border-radius: 12px;
-    font-size: 16px;
-    background: rgba(255, 255, 255, 0.9);
-    box-shadow: 0 4px 15px rgba(0,0,0,0.1);
-}
-
-.search-box:focus {
-    outline: 2px solid #667eea;
-    background: white;
-}
-
-.users-container {
-    background: rgba(255, 255, 255, 0.15);
-    backdrop-filter: blur(15px);
-    border-radius: 15px;
-    padding: 20px;
-    color: white;
-}
-
-.users-header {
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-    margin-bottom: 15px;
-    flex-wrap: wrap;
-    gap: 10px;
-}
-
-.users-title {
-    font-size: 18px;
-    font-weight: 500;
-}
-
-.user-count {
-    background: rgba(255, 255, 255, 0.2);
-    padding: 5px 12px;
-    border-radius: 20px;
-    font-size: 14px;
-}
-
-.user-card {
-    background: rgba(255, 255, 255, 0.2);
-    padding: 15px;
-    border-radius: 12px;
-    margin-bottom: 10px;
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-    transition: all 0.3s;
-    border: 1px solid rgba(255, 255, 255, 0.1);
-}
-
-.user-card:hover {
-    background: rgba(255, 255, 255, 0.3);
-    transform: translateX(5px);
-}
-
-.user-info {
-    flex: 1;
-}
-
-.user-name {
-    font-size: 16px;
-    font-weight: 600;
-    margin-bottom: 4px;
-    display: flex;
-    align-items: center;
-    gap: 8px;
-    flex-wrap: wrap;
-}
-
-.user-badge {
-    background: #48bb78;
-    color: white;
-    padding: 2px 8px;
-    border-radius: 12px;
-    font-size: 10px;
-    font-weight: 600;
-}
-
-.user-email {
-    font-size: 12px;
-    opacity: 0.8;
-    margin-bottom: 4px;
-}
-
-.user-meta {
-    display: flex;
-    gap: 15px;
-    font-size: 12px;
-    opacity: 0.8;
-    flex-wrap: wrap;
-}
-
-.user-meta span {
-    display: flex;
-    align-items: center;
-    gap: 4px;
-}
-
-.action-buttons {
-    display: flex;
-    gap: 8px;
-    flex-wrap: wrap;
-}
-
-.login-btn {
-    background: #667eea;
-    color: white;
-    padding: 8px 12px;
-    border: none;
-    border-radius: 8px;
-    font-size: 12px;
-    font-weight: 500;
-    cursor: pointer;
-    text-decoration: none;
-    display: inline-flex;
-    align-items: center;
-    gap: 5px;
-    white-space: nowrap;
-}
-
-.login-btn:hover {
-    background: #5a67d8;
-}
-
-.delete-btn {
-    background: #f56565;
-    color: white;
-    padding: 8px 12px;
-    border: none;
-    border-radius: 8px;
-    font-size: 12px;
-    font-weight: 500;
-    cursor: pointer;
-    text-decoration: none;
-    display: inline-flex;
-    align-items: center;
-    gap: 5px;
-    white-space: nowrap;
-}
-
-.delete-btn:hover {
-    background: #e53e3e;
-}
-
-.empty-state {
-    text-align: center;
-    padding: 40px 20px;
-    color: white;
-    opacity: 0.8;
-}
-
-.empty-state p {
-    margin-bottom: 10px;
-}
-
-.no-results {
-    text-align: center;
-    padding: 30px;
-    color: white;
-    opacity: 0.7;
-    font-style: italic;
-}
-
-.bottom-nav {
-    position: fixed;
-    bottom: 0;
-    left: 0;
-    right: 0;
-    background: white;
-    padding: 15px;
-    display: flex;
-    justify-content: space-around;
-    box-shadow: 0 -2px 10px rgba(0,0,0,0.1);
-    border-top-left-radius: 20px;
-    border-top-right-radius: 20px;
-}
-
-.nav-btn {
-    flex: 1;
-    margin: 0 5px;
-    padding: 12px;
-    border: none;
-    border-radius: 10px;
-    font-size: 14px;
-    font-weight: 600;
-    cursor: pointer;
-    text-align: center;
-    text-decoration: none;
-}
-
-.nav-btn.primary {
-    background: #667eea;
-    color: white;
-}
-
-.nav-btn.secondary {
-    background: #48bb78;
-    color: white;
-}
-
-.nav-btn.active {
-    opacity: 1;
-    transform: translateY(-2px);
-    box-shadow: 0 4px 10px rgba(0,0,0,0.2);
-}
-
-/* Delete Confirmation Modal */
-.modal {
-    display: none;
-    position: fixed;
-    top: 0;
-    left: 0;
-    right: 0;
-    bottom: 0;
-    background: rgba(0,0,0,0.5);
-    align-items: center;
-    justify-content: center;
-    z-index: 1000;
-}
-
-.modal-content {
-    background: white;
-    padding: 30px;
-    border-radius: 20px;
-    max-width: 300px;
-    text-align: center;
-}
-
-.modal-content h3 {
-    color: #333;
-    margin-bottom: 10px;
-}
-
-.modal-content p {
-    color: #666;
-    margin-bottom: 20px;
-}
-
-.modal-buttons {
-    display: flex;
-    gap: 10px;
-}
-
-.modal-btn {
-    flex: 1;
-    padding: 12px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    font-weight: 600;
-}
-
-.confirm-btn {
-    background: #f56565;
-    color: white;
-}
-
-.cancel-btn {
-    background: #e0e0e0;
-    color: #333;
-}
-
-/* Mobile Responsive */
-@media(max-width: 768px) {
-    .user-card {
-        flex-direction: column;
-        align-items: flex-start;
-        gap: 10px;
-    }
-    
-    .action-buttons {
-        width: 100%;
-    }
-    
-    .login-btn, .delete-btn {
-        flex: 1;
-        text-align: center;
-        justify-content: center;
-    }
-    
-    .stats-grid {
-        grid-template-columns: 1fr 1fr;
-    }
-}
-
-@media(max-width: 480px) {
-    .user-meta {
-        flex-direction: column;
-        gap: 5px;
-    }
-}
-</style>
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/admin.css') }}">
 </head>
 <body>
 
@@ -1115,21 +902,31 @@ body {
 <div class="users-container">
     <div class="users-header">
         <div class="users-title">👥 User Management</div>
-        <div class="user-count">{{users|length}} users</div>
+        <div class="user-count">{{total_users}} users</div>
     </div>
     
-    <div class="search-container">
-        <input type="text" id="searchInput" class="search-box" placeholder="🔍 Search by username or email..." onkeyup="filterUsers()">
+    <form class="search-container" method="get" action="/admin">
+        <input type="text" name="q" value="{{search}}" class="search-box" placeholder="🔍 Search by username or email prefix...">
+    </form>
+    
+    <div class="sort-links">
+        <span>Sort:</span>
+        <a href="/admin?sort=name&q={{search|urlencode}}" class="sort-link {% if sort == 'name' %}active{% endif %}">🔤 Name</a>
+        <a href="/admin?sort=joined&q={{search|urlencode}}" class="sort-link {% if sort == 'joined' %}active{% endif %}">📅 Newest</a>
+        <a href="/admin?sort=entries&q={{search|urlencode}}" class="sort-link {% if sort == 'entries' %}active{% endif %}">📝 Entries</a>
+        <a href="/admin?sort=storage&q={{search|urlencode}}" class="sort-link {% if sort == 'storage' %}active{% endif %}">💾 Storage</a>
     </div>
     
     <div id="usersList">
         {% if users %}
             {% for u in users %}
-            <div class="user-card" data-username="{{u.username|lower}}" data-email="{{u.email|lower}}">
+            <div class="user-card">
                 <div class="user-info">
                     <div class="user-name">
                         {{u.username}}
-                        {% if u.entry_count > 0 %}
+                        {% if u.deleted_at %}
+                        <span class="user-badge deleting">Deleting… {{u.entry_count}} entries, {{u.photo_count}} photos left</span>
+                        {% elif u.entry_count > 0 %}
                         <span class="user-badge">{{u.entry_count}} entries</span>
                         {% endif %}
                     </div>
@@ -1139,9 +936,11 @@ body {
                     <div class="user-meta">
                         <span>📝 {{u.entry_count}} entries</span>
                         <span>📸 {{u.photo_count}} photos</span>
+                        <span>💾 {{'%.1f'|format(u.storage_bytes / 1048576)}} MB</span>
                         <span>📅 Joined: {{u.created_at[:10]}}</span>
                     </div>
                 </div>
+                {% if not u.deleted_at %}
                 <div class="action-buttons">
                     <a href="/admin_login/{{u.id}}" class="login-btn">
                         🔑 Login
@@ -1150,8 +949,13 @@ body {
                         🗑️ Delete
                     </button>
                 </div>
+                {% endif %}
             </div>
             {% endfor %}
+        {% elif search %}
+            <div class="no-results">
+                🔍 No users matching your search
+            </div>
         {% else %}
             <div class="empty-state">
                 <p>📭 No users found</p>
@@ -1160,9 +964,16 @@ body {
         {% endif %}
     </div>
     
-    <div id="noResults" class="no-results" style="display: none;">
-        🔍 No users matching your search
+    {% if prev_cursor or next_cursor %}
+    <div class="pagination">
+        {% if prev_cursor %}
+        <a href="/admin?sort={{sort}}&q={{search|urlencode}}&before={{prev_cursor}}" class="page-link">← Previous</a>
+        {% endif %}
+        {% if next_cursor %}
+        <a href="/admin?sort={{sort}}&q={{search|urlencode}}&after={{next_cursor}}" class="page-link">Next →</a>
+        {% endif %}
     </div>
+    {% endif %}
 </div>
 
 <div class="bottom-nav">
@@ -1182,53 +993,7 @@ body {
     </div>
 </div>
 
-<script>
-let deleteUserId = null;
-
-function filterUsers() {
-    const searchInput = document.getElementById('searchInput').value.toLowerCase();
-    const userCards = document.querySelectorAll('.user-card');
-    let visibleCount = 0;
-    
-    userCards.forEach(card => {
-        const username = card.getAttribute('data-username');
-        const email = card.getAttribute('data-email') || '';
-        if (username.includes(searchInput) || email.includes(searchInput)) {
-            card.style.display = 'flex';
-            visibleCount++;
-        } else {
-            card.style.display = 'none';
-        }
-    });
-    
-    const noResults = document.getElementById('noResults');
-    if (visibleCount === 0) {
-        noResults.style.display = 'block';
-    } else {
-        noResults.style.display = 'none';
-    }
-}
-
-function showDeleteModal(userId, username) {
-    deleteUserId = userId;
-    document.getElementById('deleteMessage').innerHTML = `Are you sure you want to delete user <strong>${username}</strong>? This will delete all their entries and photos.`;
-    document.getElementById('deleteModal').style.display = 'flex';
-}
-
-function hideDeleteModal() {
-    document.getElementById('deleteModal').style.display = 'none';
-    deleteUserId = null;
-}
-
-function confirmDelete() {
-    if (deleteUserId) {
-        window.location.href = '/admin_delete/' + deleteUserId;
-    }
-}
-
-// Live search as you type
-document.getElementById('searchInput').addEventListener('keyup', filterUsers);
-</script>
+<script src="{{ asset_url('js/admin.js') }}"></script>
 
 </body>
 </html>
@@ -1242,219 +1007,11 @@ ENTRIES_PAGE = """
 <head>
 <title>My Diary - Entries</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
-
-body {
-    background: linear-gradient(135deg, #667eea, #764ba2);
-    min-height: 100vh;
-    padding: 20px;
-    padding-bottom: 80px;
-}
-
-.header {
-    background: rgba(0, 0, 0, 0.7);
-    color: white;
-    padding: 15px 20px;
-    border-radius: 15px;
-    margin-bottom: 20px;
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-    flex-wrap: wrap;
-    gap: 10px;
-}
-
-.header h3 {
-    font-size: 18px;
-}
-
-.user-badge {
-    background: #48bb78;
-    color: white;
-    padding: 5px 10px;
-    border-radius: 20px;
-    font-size: 12px;
-    font-weight: 600;
-}
-
-.header-buttons {
-    display: flex;
-    gap: 10px;
-    flex-wrap: wrap;
-}
-
-.logout-btn {
-    background: #f56565;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-.change-password-btn {
-    background: #f6ad55;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-.entries-container {
-    background: rgba(255, 255, 255, 0.15);
-    backdrop-filter: blur(15px);
-    border-radius: 15px;
-    padding: 20px;
-    color: white;
-}
-
-.entries-title {
-    margin-bottom: 15px;
-    font-size: 20px;
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-}
-
-.entry-card {
-    background: rgba(255, 255, 255, 0.25);
-    padding: 15px;
-    border-radius: 12px;
-    margin-bottom: 10px;
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-    transition: all 0.3s;
-    border: 1px solid rgba(255, 255, 255, 0.1);
-    cursor: pointer;
-}
-
-.entry-card:active {
-    transform: scale(0.98);
-    background: rgba(255, 255, 255, 0.35);
-}
-
-.entry-info b {
-    color: white;
-    font-size: 16px;
-}
-
-.entry-preview {
-    font-size: 12px;
-    opacity: 0.8;
-    margin-top: 3px;
-    color: rgba(255, 255, 255, 0.9);
-}
-
-.view-btn {
-    background: #48bb78;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    font-size: 14px;
-    cursor: pointer;
-    text-decoration: none;
-    pointer-events: none;
-}
-
-.empty-state {
-    text-align: center;
-    padding: 40px 20px;
-    color: white;
-    opacity: 0.8;
-}
-
-.empty-state p {
-    margin-bottom: 20px;
-}
-
-.bottom-nav {
-    position: fixed;
-    bottom: 0;
-    left: 0;
-    right: 0;
-    background: white;
-    padding: 15px;
-    display: flex;
-    justify-content: space-around;
-    box-shadow: 0 -2px 10px rgba(0,0,0,0.1);
-    border-top-left-radius: 20px;
-    border-top-right-radius: 20px;
-}
-
-.nav-btn {
-    flex: 1;
-    margin: 0 5px;
-    padding: 12px;
-    border: none;
-    border-radius: 10px;
-    font-size: 14px;
-    font-weight: 600;
-    cursor: pointer;
-    text-align: center;
-    text-decoration: none;
-}
-
-.nav-btn.primary {
-    background: #667eea;
-    color: white;
-}
-
-.nav-btn.secondary {
-    background: #48bb78;
-    color: white;
-}
-
-.nav-btn.active {
-    opacity: 1;
-    transform: translateY(-2px);
-    box-shadow: 0 4px 10px rgba(0,0,0,0.2);
-}
-
-/* Admin link for normal users */
-.admin-link {
-    background: #f6ad55;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-/* Mobile Responsive */
-@media(max-width: 480px) {
-    .header {
-        flex-direction: column;
-        align-items: flex-start;
-    }
-    
-    .header-buttons {
-        width: 100%;
-    }
-    
-    .change-password-btn, .logout-btn, .admin-link {
-        flex: 1;
-        text-align: center;
-    }
-}
-</style>
-</head>
-<body>
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/entries.css') }}">
+</head>
+<body>
 
 <div class="header">
     <div style="display: flex; align-items: center; gap: 10px; flex-wrap: wrap;">
@@ -1465,6 +1022,8 @@ body {
     </div>
     <div class="header-buttons">
         <a href="/change-password" class="change-password-btn">🔐 Change Password</a>
+        <a href="/export" class="export-btn">💾 Export</a>
+        <a href="/import" class="export-btn">📥 Import</a>
         {% if session.get('is_admin') %}
         <a href="/admin" class="admin-link">👑 Admin Panel</a>
         {% endif %}
@@ -1472,6 +1031,29 @@ body {
     </div>
 </div>
 
+<form class="filter-bar" method="get" action="/entries">
+    <input type="date" name="from" value="{{date_from or ''}}" aria-label="From">
+    <input type="date" name="to" value="{{date_to or ''}}" aria-label="To">
+    <button type="submit" class="filter-btn">🔍 Filter</button>
+    {% if date_from or date_to %}
+    <a href="/entries" class="filter-btn clear">✕ Clear</a>
+    {% endif %}
+    <a href="/calendar" class="filter-btn calendar">📅 Calendar</a>
+</form>
+
+{{entries_html}}
+
+<div class="bottom-nav">
+    <a href="/entries" class="nav-btn primary active">📋 Entries</a>
+    <a href="/new" class="nav-btn secondary">➕ New</a>
+</div>
+
+</body>
+</html>
+"""
+
+# The entries list itself is rendered separately so it can be cached per user
+ENTRIES_LIST_FRAGMENT = """
 <div class="entries-container">
     <div class="entries-title">
         <span>📝 Your Entries ({{entries|length}})</span>
@@ -1488,10 +1070,17 @@ body {
                 {% if e.preview %}
                 <div class="entry-preview">{{e.preview[:30]}}...</div>
                 {% endif %}
+                {% if e.word_count %}
+                <div class="entry-preview">{{e.word_count}} word{{'s' if e.word_count != 1 else ''}}</div>
+                {% endif %}
             </div>
             <span class="view-btn">View →</span>
         </div>
         {% endfor %}
+    {% elif filtered %}
+        <div class="empty-state">
+            <p>📭 No entries in this date range</p>
+        </div>
     {% else %}
         <div class="empty-state">
             <p>📭 No entries yet</p>
@@ -1500,14 +1089,6 @@ body {
         </div>
     {% endif %}
 </div>
-
-<div class="bottom-nav">
-    <a href="/entries" class="nav-btn primary active">📋 Entries</a>
-    <a href="/new" class="nav-btn secondary">➕ New</a>
-</div>
-
-</body>
-</html>
 """
 
 # ---------------- NEW ENTRY PAGE ----------------
@@ -1518,195 +1099,9 @@ NEW_ENTRY_PAGE = """
 <head>
 <title>New Entry</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
-
-body {
-    background: linear-gradient(135deg, #667eea, #764ba2);
-    min-height: 100vh;
-    padding: 20px;
-    padding-bottom: 80px;
-}
-
-.header {
-    background: rgba(0, 0, 0, 0.7);
-    color: white;
-    padding: 15px 20px;
-    border-radius: 15px;
-    margin-bottom: 20px;
-    display: flex;
-    align-items: center;
-    gap: 15px;
-}
-
-.back-btn {
-    background: #667eea;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-.header h3 {
-    font-size: 18px;
-    flex: 1;
-}
-
-.form-container {
-    background: white;
-    border-radius: 15px;
-    padding: 25px;
-    box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-}
-
-.form-container h2 {
-    color: #333;
-    margin-bottom: 20px;
-    font-size: 22px;
-}
-
-.form-group {
-    margin-bottom: 20px;
-}
-
-label {
-    display: block;
-    margin-bottom: 8px;
-    color: #555;
-    font-weight: 500;
-    font-size: 14px;
-}
-
-input[type="date"] {
-    width: 100%;
-    padding: 12px;
-    border: 2px solid #e0e0e0;
-    border-radius: 10px;
-    font-size: 14px;
-}
-
-textarea {
-    width: 100%;
-    padding: 12px;
-    border: 2px solid #e0e0e0;
-    border-radius: 10px;
-    min-height: 150px;
-    font-size: 14px;
-}
-
-input[type="file"] {
-    width: 100%;
-    padding: 10px;
-    border: 2px dashed #e0e0e0;
-    border-radius: 10px;
-    margin-bottom: 5px;
-}
-
-small {
-    display: block;
-    color: #666;
-    font-size: 12px;
-    margin-top: 5px;
-}
-
-.button-group {
-    display: flex;
-    gap: 10px;
-    margin-top: 20px;
-}
-
-.btn {
-    flex: 1;
-    padding: 14px;
-    border: none;
-    border-radius: 10px;
-    font-size: 16px;
-    font-weight: 600;
-    cursor: pointer;
-    text-align: center;
-    text-decoration: none;
-}
-
-.btn.primary {
-    background: #667eea;
-    color: white;
-}
-
-.btn.secondary {
-    background: #48bb78;
-    color: white;
-}
-
-.btn.danger {
-    background: #f56565;
-    color: white;
-}
-
-.bottom-nav {
-    position: fixed;
-    bottom: 0;
-    left: 0;
-    right: 0;
-    background: white;
-    padding: 15px;
-    display: flex;
-    justify-content: space-around;
-    box-shadow: 0 -2px 10px rgba(0,0,0,0.1);
-    border-top-left-radius: 20px;
-    border-top-right-radius: 20px;
-}
-
-.nav-btn {
-    flex: 1;
-    margin: 0 5px;
-    padding: 12px;
-    border: none;
-    border-radius: 10px;
-    font-size: 14px;
-    font-weight: 600;
-    cursor: pointer;
-    text-align: center;
-    text-decoration: none;
-}
-
-.nav-btn.primary {
-    background: #667eea;
-    color: white;
-}
-
-.nav-btn.secondary {
-    background: #48bb78;
-    color: white;
-}
-
-.nav-btn.active {
-    background: #48bb78;
-    color: white;
-    opacity: 1;
-}
-
-.flash-message {
-    padding: 12px;
-    border-radius: 8px;
-    margin-bottom: 20px;
-    text-align: center;
-}
-
-.flash-message.error {
-    background: #fed7d7;
-    color: #742a2a;
-    border: 1px solid #feb2b2;
-}
-</style>
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/new-entry.css') }}">
 </head>
 <body>
 
@@ -1722,15 +1117,23 @@ small {
     <div class="flash-message error">{{message}}</div>
     {% endif %}
     
-    <form method="post" action="/save" enctype="multipart/form-data">
+    {% if draft %}
+    <div class="flash-message notice">
+        Restored your unsaved draft from {{draft.updated_at}} UTC.
+        <button type="button" class="draft-discard" data-draft-discard>Discard draft</button>
+    </div>
+    {% endif %}
+    
+    <form method="post" action="/save" enctype="multipart/form-data" data-draft-url="/api/v1/drafts/new">
+        <input type="hidden" name="account" value="{{session.user_id}}">
         <div class="form-group">
             <label>📅 Date</label>
-            <input type="date" name="date" value="{{today}}" required>
+            <input type="date" name="date" value="{{draft.date if draft and draft.date else today}}" required>
         </div>
         
         <div class="form-group">
             <label>📝 Your Thoughts</label>
-            <textarea name="content" placeholder="What's on your mind today?" required></textarea>
+            <textarea name="content" placeholder="What's on your mind today?" required>{{draft.content if draft}}</textarea>
         </div>
         
         <div class="form-group">
@@ -1751,6 +1154,7 @@ small {
     <a href="/new" class="nav-btn secondary active">➕ New</a>
 </div>
 
+<script src="{{ asset_url('js/draft.js') }}"></script>
 </body>
 </html>
 """
@@ -1763,187 +1167,9 @@ EDIT_ENTRY_PAGE = """
 <head>
 <title>Edit Entry</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
-
-body {
-    background: linear-gradient(135deg, #667eea, #764ba2);
-    min-height: 100vh;
-    padding: 20px;
-    padding-bottom: 80px;
-}
-
-.header {
-    background: rgba(0, 0, 0, 0.7);
-    color: white;
-    padding: 15px 20px;
-    border-radius: 15px;
-    margin-bottom: 20px;
-    display: flex;
-    align-items: center;
-    gap: 15px;
-}
-
-.back-btn {
-    background: #667eea;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-.header h3 {
-    font-size: 18px;
-    flex: 1;
-}
-
-.form-container {
-    background: white;
-    border-radius: 15px;
-    padding: 25px;
-    box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-}
-
-.form-container h2 {
-    color: #333;
-    margin-bottom: 20px;
-    font-size: 22px;
-}
-
-.form-group {
-    margin-bottom: 20px;
-}
-
-label {
-    display: block;
-    margin-bottom: 8px;
-    color: #555;
-    font-weight: 500;
-    font-size: 14px;
-}
-
-input[type="date"] {
-    width: 100%;
-    padding: 12px;
-    border: 2px solid #e0e0e0;
-    border-radius: 10px;
-    font-size: 14px;
-}
-
-textarea {
-    width: 100%;
-    padding: 12px;
-    border: 2px solid #e0e0e0;
-    border-radius: 10px;
-    min-height: 150px;
-    font-size: 14px;
-}
-
-input[type="file"] {
-    width: 100%;
-    padding: 10px;
-    border: 2px dashed #e0e0e0;
-    border-radius: 10px;
-    margin-bottom: 5px;
-}
-
-small {
-    display: block;
-    color: #666;
-    font-size: 12px;
-    margin-top: 5px;
-}
-
-.current-photos {
-    margin-bottom: 20px;
-}
-
-.current-photos h4 {
-    color: #555;
-    margin-bottom: 10px;
-    font-size: 16px;
-}
-
-.photo-list {
-    display: flex;
-    flex-wrap: wrap;
-    gap: 10px;
-}
-
-.photo-item {
-    width: 80px;
-    height: 80px;
-    border-radius: 8px;
-    overflow: hidden;
-    border: 2px solid #e0e0e0;
-}
-
-.photo-item img {
-    width: 100%;
-    height: 100%;
-    object-fit: cover;
-}
-
-.button-group {
-    display: flex;
-    gap: 10px;
-    margin-top: 20px;
-}
-
-.btn {
-    flex: 1;
-    padding: 14px;
-    border: none;
-    border-radius: 10px;
-    font-size: 16px;
-    font-weight: 600;
-    cursor: pointer;
-    text-align: center;
-    text-decoration: none;
-}
-
-.btn.primary {
-    background: #667eea;
-    color: white;
-}
-
-.btn.secondary {
-    background: #48bb78;
-    color: white;
-}
-
-.btn.danger {
-    background: #f56565;
-    color: white;
-}
-
-.btn.edit {
-    background: #f6ad55;
-    color: white;
-}
-
-.flash-message {
-    padding: 12px;
-    border-radius: 8px;
-    margin-bottom: 20px;
-    text-align: center;
-}
-
-.flash-message.error {
-    background: #fed7d7;
-    color: #742a2a;
-    border: 1px solid #feb2b2;
-}
-</style>
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/edit-entry.css') }}">
 </head>
 <body>
 
@@ -1959,7 +1185,17 @@ small {
     <div class="flash-message error">{{message}}</div>
     {% endif %}
     
-    <form method="post" action="/update/{{entry.id}}" enctype="multipart/form-data">
+    {% if draft %}
+    <div class="flash-message notice">
+        Restored your unsaved changes from {{draft.updated_at}} UTC.
+        {% if draft.base_version != draft.entry_version %}The entry has been saved elsewhere since then.{% endif %}
+        <button type="button" class="draft-discard" data-draft-discard>Discard changes</button>
+    </div>
+    {% endif %}
+    
+    <form method="post" action="/update/{{entry.id}}" enctype="multipart/form-data" data-draft-url="/api/v1/drafts/{{entry.id}}">
+        <input type="hidden" name="account" value="{{session.user_id}}">
+        <input type="hidden" name="version" value="{{entry.version}}">
         <div class="form-group">
             <label>📅 Date</label>
             <input type="date" name="date" value="{{entry.date}}" required>
@@ -1976,7 +1212,9 @@ small {
             <div class="photo-list">
                 {% for p in photos %}
                 <div class="photo-item">
-                    <img src="/uploads/{{p.filename}}" alt="Photo">
+                    <img src="/uploads/{{p.filename}}" alt="Photo" loading="lazy" decoding="async"
+                         {% if p.width %}width="{{p.width}}" height="{{p.height}}"{% endif %}
+                         {% if p.placeholder %}style="background-image: url('{{p.placeholder}}')"{% endif %}>
                 </div>
                 {% endfor %}
             </div>
@@ -1996,6 +1234,7 @@ small {
     </form>
 </div>
 
+<script src="{{ asset_url('js/draft.js') }}"></script>
 </body>
 </html>
 """
@@ -2008,260 +1247,9 @@ VIEW_ENTRY_PAGE = """
 <head>
 <title>View Entry</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
-
-body {
-    background: linear-gradient(135deg, #667eea, #764ba2);
-    min-height: 100vh;
-    padding: 20px;
-    padding-bottom: 80px;
-}
-
-.header {
-    background: rgba(0, 0, 0, 0.7);
-    color: white;
-    padding: 15px 20px;
-    border-radius: 15px;
-    margin-bottom: 20px;
-    display: flex;
-    align-items: center;
-    gap: 15px;
-}
-
-.back-btn {
-    background: #667eea;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-}
-
-.header h3 {
-    font-size: 18px;
-    flex: 1;
-}
-
-.entry-container {
-    background: white;
-    border-radius: 15px;
-    padding: 25px;
-    box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-}
-
-.entry-header {
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-    margin-bottom: 20px;
-    padding-bottom: 15px;
-    border-bottom: 2px solid #f0f0f0;
-    flex-wrap: wrap;
-    gap: 10px;
-}
-
-.entry-date h2 {
-    color: #333;
-    font-size: 20px;
-}
-
-.action-buttons {
-    display: flex;
-    gap: 10px;
-    flex-wrap: wrap;
-}
-
-.action-btn {
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-    font-weight: 500;
-    display: inline-flex;
-    align-items: center;
-    gap: 5px;
-}
-
-.edit-btn {
-    background: #f6ad55;
-    color: white;
-}
-
-.delete-btn {
-    background: #f56565;
-    color: white;
-}
-
-.new-btn {
-    background: #667eea;
-    color: white;
-    padding: 8px 15px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    text-decoration: none;
-    font-size: 14px;
-    display: inline-flex;
-    align-items: center;
-    gap: 5px;
-}
-
-.entry-content {
-    background: #f9f9f9;
-    padding: 20px;
-    border-radius: 12px;
-    line-height: 1.6;
-    color: #333;
-    white-space: pre-wrap;
-    margin-bottom: 20px;
-}
-
-.photos-section {
-    margin-top: 20px;
-}
-
-.photos-section h3 {
-    color: #333;
-    margin-bottom: 15px;
-    font-size: 18px;
-}
-
-.photos-grid {
-    display: grid;
-    grid-template-columns: repeat(auto-fill, minmax(120px, 1fr));
-    gap: 10px;
-}
-
-.photos-grid img {
-    width: 100%;
-    height: 120px;
-    object-fit: cover;
-    border-radius: 10px;
-    border: 2px solid #f0f0f0;
-}
-
-.bottom-nav {
-    position: fixed;
-    bottom: 0;
-    left: 0;
-    right: 0;
-    background: white;
-    padding: 15px;
-    display: flex;
-    justify-content: space-around;
-    box-shadow: 0 -2px 10px rgba(0,0,0,0.1);
-    border-top-left-radius: 20px;
-    border-top-right-radius: 20px;
-}
-
-.nav-btn {
-    flex: 1;
-    margin: 0 5px;
-    padding: 12px;
-    border: none;
-    border-radius: 10px;
-    font-size: 14px;
-    font-weight: 600;
-    cursor: pointer;
-    text-align: center;
-    text-decoration: none;
-}
-
-.nav-btn.primary {
-    background: #667eea;
-    color: white;
-}
-
-.nav-btn.secondary {
-    background: #48bb78;
-    color: white;
-}
-
-/* Delete Confirmation Modal */
-.modal {
-    display: none;
-    position: fixed;
-    top: 0;
-    left: 0;
-    right: 0;
-    bottom: 0;
-    background: rgba(0,0,0,0.5);
-    align-items: center;
-    justify-content: center;
-    z-index: 1000;
-}
-
-.modal-content {
-    background: white;
-    padding: 30px;
-    border-radius: 20px;
-    max-width: 300px;
-    text-align: center;
-}
-
-.modal-content h3 {
-    color: #333;
-    margin-bottom: 10px;
-}
-
-.modal-content p {
-    color: #666;
-    margin-bottom: 20px;
-}
-
-.modal-buttons {
-    display: flex;
-    gap: 10px;
-}
-
-.modal-btn {
-    flex: 1;
-    padding: 12px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    font-weight: 600;
-}
-
-.confirm-btn {
-    background: #f56565;
-    color: white;
-}
-
-.cancel-btn {
-    background: #e0e0e0;
-    color: #333;
-}
-
-/* Mobile Responsive */
-@media(max-width: 480px) {
-    .entry-header {
-        flex-direction: column;
-        align-items: flex-start;
-    }
-    
-    .action-buttons {
-        width: 100%;
-    }
-    
-    .action-btn {
-        flex: 1;
-        text-align: center;
-        justify-content: center;
-    }
-}
-</style>
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/view-entry.css') }}">
 </head>
 <body>
 
@@ -2277,6 +1265,7 @@ body {
         </div>
         <div class="action-buttons">
             <a href="/edit/{{entry.id}}" class="action-btn edit-btn">✏️ Edit</a>
+            <a href="/view/{{entry.id}}/history" class="action-btn history-btn">🕘 History</a>
             <button onclick="showDeleteModal()" class="action-btn delete-btn">🗑️ Delete</button>
             <a href="/new" class="new-btn">+ New</a>
         </div>
@@ -2291,7 +1280,9 @@ body {
         <h3>📸 Photos</h3>
         <div class="photos-grid">
             {% for p in photos %}
-            <img src="/uploads/{{p.filename}}" alt="Entry photo">
+            <img src="/uploads/{{p.filename}}" alt="Entry photo" loading="lazy" decoding="async"
+                 {% if p.width %}width="{{p.width}}" height="{{p.height}}"{% endif %}
+                 {% if p.placeholder %}style="background-image: url('{{p.placeholder}}')"{% endif %}>
             {% endfor %}
         </div>
     </div>
@@ -2304,7 +1295,7 @@ body {
 </div>
 
 <!-- Delete Confirmation Modal -->
-<div id="deleteModal" class="modal">
+<div id="deleteModal" class="modal" data-delete-url="/delete/{{entry.id}}">
     <div class="modal-content">
         <h3>🗑️ Delete Entry</h3>
         <p>Are you sure you want to delete this entry? This action cannot be undone.</p>
@@ -2315,19 +1306,65 @@ body {
     </div>
 </div>
 
-<script>
-function showDeleteModal() {
-    document.getElementById('deleteModal').style.display = 'flex';
-}
+<script src="{{ asset_url('js/view-entry.js') }}"></script>
 
-function hideDeleteModal() {
-    document.getElementById('deleteModal').style.display = 'none';
-}
+</body>
+</html>
+"""
 
-function deleteEntry() {
-    window.location.href = '/delete/{{entry.id}}';
-}
-</script>
+# ---------------- ENTRY HISTORY PAGE ----------------
+
+HISTORY_PAGE = """
+<!DOCTYPE html>
+<html>
+<head>
+<title>Entry History</title>
+<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/history.css') }}">
+</head>
+<body>
+
+<div class="header">
+    <a href="/view/{{entry.id}}" class="back-btn">← Back</a>
+    <h3>🕘 Entry History</h3>
+</div>
+
+<div class="history-container">
+    {% if selected %}
+    <div class="revision-view">
+        <h2>📅 {{selected.date}} <span class="revision-meta">version {{selected.version}}, replaced {{selected.saved_at}} UTC</span></h2>
+        <form method="post" action="/update/{{entry.id}}">
+            <input type="hidden" name="account" value="{{session.user_id}}">
+            <input type="hidden" name="version" value="{{entry.version}}">
+            <input type="hidden" name="date" value="{{selected.date}}">
+            <textarea name="content" readonly>{{selected.content}}</textarea>
+            <div class="button-group">
+                <button type="submit" class="btn primary">↩️ Restore this version</button>
+                <a href="/view/{{entry.id}}/history" class="btn secondary">Close</a>
+            </div>
+        </form>
+    </div>
+    {% elif missing %}
+    <div class="flash-message error">That version is no longer kept.</div>
+    {% endif %}
+    
+    <div class="revision-list">
+        <div class="revision-item current">
+            <span class="revision-date">📅 {{entry.date}}</span>
+            <span class="revision-meta">version {{entry.version}} (current) · {{entry.word_count}} words</span>
+        </div>
+        {% for r in revisions %}
+        <a href="/view/{{entry.id}}/history?version={{r.version}}" class="revision-item{% if selected and selected.version == r.version %} active{% endif %}">
+            <span class="revision-date">📅 {{r.date}}</span>
+            <span class="revision-meta">version {{r.version}} · {{r.word_count}} words · replaced {{r.saved_at}} UTC</span>
+        </a>
+        {% else %}
+        <p class="empty">No earlier versions yet - they appear here once the entry is edited.</p>
+        {% endfor %}
+    </div>
+</div>
 
 </body>
 </html>
@@ -2341,98 +1378,184 @@ SUCCESS_PAGE = """
 <head>
 <title>Success</title>
 <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
-<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-<style>
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/success.css') }}">
+</head>
+<body>
 
-body {
-    background: linear-gradient(135deg, #667eea, #764ba2);
-    min-height: 100vh;
-    display: flex;
-    align-items: center;
-    justify-content: center;
-    padding: 20px;
-}
+<div class="success-card">
+    <div class="success-icon">✅</div>
+    <h2>{{message}}</h2>
+    <p>{{submessage}}</p>
+    
+    <div class="button-group">
+        <a href="/view/{{entry_id}}" class="btn primary">View Entry</a>
+        <a href="/new" class="btn secondary">Write Another</a>
+        <a href="/entries" class="btn edit">Back to Entries</a>
+    </div>
+</div>
 
-.success-card {
-    background: white;
-    border-radius: 20px;
-    padding: 40px 30px;
-    text-align: center;
-    box-shadow: 0 20px 40px rgba(0,0,0,0.2);
-    max-width: 400px;
-    width: 100%;
-}
+</body>
+</html>
+"""
 
-.success-icon {
-    font-size: 60px;
-    margin-bottom: 20px;
-}
+# ---------------- OFFLINE PAGE ----------------
 
-.success-card h2 {
-    color: #48bb78;
-    margin-bottom: 10px;
-    font-size: 24px;
-}
+# Precached by the service worker and shown when a page isn't available offline
+OFFLINE_PAGE = """
+<!DOCTYPE html>
+<html>
+<head>
+<title>Offline</title>
+<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/success.css') }}">
+</head>
+<body>
 
-.success-card p {
-    color: #666;
-    margin-bottom: 30px;
-    font-size: 16px;
-}
+<div class="success-card">
+    {% if queued %}
+    <div class="success-icon">📥</div>
+    <h2>Saved on this device</h2>
+    <p>You're offline. Your entry will be sent automatically as soon as you're back online.</p>
+    {% else %}
+    <div class="success-icon">📴</div>
+    <h2>You're offline</h2>
+    <p>This page hasn't been saved for offline reading. Entries you opened recently are still available.</p>
+    {% endif %}
+    
+    <div class="button-group">
+        <a href="/entries" class="btn primary">Back to Entries</a>
+        <a href="/new" class="btn secondary">Write Another</a>
+    </div>
+</div>
 
-.button-group {
-    display: flex;
-    gap: 10px;
-    flex-direction: column;
-}
+</body>
+</html>
+"""
 
-.btn {
-    padding: 14px;
-    border: none;
-    border-radius: 10px;
-    font-size: 16px;
-    font-weight: 600;
-    cursor: pointer;
-    text-align: center;
-    text-decoration: none;
-}
+# ---------------- IMPORT PAGE ----------------
+
+IMPORT_PAGE = """
+<!DOCTYPE html>
+<html>
+<head>
+<title>Import Diary</title>
+<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
+{% if running %}<meta http-equiv="refresh" content="3">{% endif %}
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/import.css') }}">
+</head>
+<body>
+
+<div class="header">
+    <a href="/entries" class="back-btn">← Back</a>
+    <h3>📥 Import Diary</h3>
+</div>
+
+<div class="form-container">
+    <h2>Import an Archive</h2>
+    
+    {% if message %}
+    <div class="flash-message error">{{message}}</div>
+    {% endif %}
+    
+    <form method="post" action="/import" enctype="multipart/form-data">
+        <input type="file" name="archive" accept=".zip,.jsonl,.json" required>
+        <small>A ZIP exported from this app (entries.jsonl + photos/) or a JSONL file with one entry per line</small>
+        <button type="submit" class="btn">📥 Start Import</button>
+    </form>
+</div>
+
+{% if imports %}
+<div class="form-container">
+    <h2>Your Imports</h2>
+    {% for job in imports %}
+    <div class="import-row">
+        <div><b>{{job.original_name or 'archive'}}</b> &middot; {{job.created_at[:16]}}</div>
+        <div>
+            <span class="import-status {{job.status}}">{{job.status}}</span>
+            &middot; {{job.entries_imported}} entries, {{job.photos_imported}} photos
+        </div>
+        {% if job.error %}<small>{{job.error}}</small>{% endif %}
+        {% if job.status in ('failed', 'interrupted') %}
+        <form method="post" action="/import/{{job.id}}/resume">
+            <button type="submit" class="resume-btn">↻ Resume</button>
+        </form>
+        {% endif %}
+    </div>
+    {% endfor %}
+</div>
+{% endif %}
 
-.btn.primary {
-    background: #667eea;
-    color: white;
-}
+</body>
+</html>
+"""
 
-.btn.secondary {
-    background: #48bb78;
-    color: white;
-}
+# ---------------- CALENDAR PAGE ----------------
 
-.btn.edit {
-    background: #f6ad55;
-    color: white;
-}
-</style>
+CALENDAR_PAGE = """
+<!DOCTYPE html>
+<html>
+<head>
+<title>My Diary - Calendar</title>
+<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=yes">
+{{ font_head }}
+{{ pwa_head }}
+<link rel="stylesheet" href="{{ asset_url('css/calendar.css') }}">
 </head>
 <body>
 
-<div class="success-card">
-    <div class="success-icon">✅</div>
-    <h2>{{message}}</h2>
-    <p>{{submessage}}</p>
+<div class="header">
+    <a href="/entries" class="back-btn">← Back</a>
+    <h3>📅 Calendar</h3>
+</div>
+
+<div class="calendar-container">
+    <div class="month-nav">
+        <a href="/calendar?month={{prev_month}}">←</a>
+        <h2>{{month_name}}</h2>
+        <a href="/calendar?month={{next_month}}">→</a>
+    </div>
     
-    <div class="button-group">
-        <a href="/view/{{entry_id}}" class="btn primary">View Entry</a>
-        <a href="/new" class="btn secondary">Write Another</a>
-        <a href="/entries" class="btn edit">Back to Entries</a>
+    <div class="calendar-grid">
+        {% for name in ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'] %}
+        <div class="weekday">{{name}}</div>
+        {% endfor %}
+        {% for day in days %}
+        {% if day.count %}
+        <a href="/entries?from={{day.date}}&to={{day.date}}" class="day level-{{day.level}} {% if day.outside %}outside{% endif %}">
+            {{day.day}}<small>{{day.count}}</small>
+        </a>
+        {% else %}
+        <div class="day {% if day.outside %}outside{% endif %}">{{day.day}}</div>
+        {% endif %}
+        {% endfor %}
+    </div>
+</div>
+
+<div class="calendar-container">
+    <div class="month-nav">
+        <h2>{{year}}</h2>
+        <a href="/entries?from={{year}}-01-01&to={{year}}-12-31">{{year_total}} entries →</a>
+    </div>
+    <div class="months-grid">
+        {% for m in months %}
+        <a href="/calendar?month={{m.key}}" class="month-cell level-{{m.level}} {% if m.key == month_key %}current{% endif %}">
+            {{m.name}}<br><b>{{m.count}}</b>
+        </a>
+        {% endfor %}
     </div>
 </div>
 
+<div class="bottom-nav">
+    <a href="/entries" class="nav-btn primary">📋 Entries</a>
+    <a href="/new" class="nav-btn secondary">➕ New</a>
+</div>
+
 </body>
 </html>
 """
@@ -2445,73 +1568,37 @@ def db_status():
     if not session.get("is_admin"):
         return "Unauthorized", 403
     
-    db = get_db()
-    
     # Get database info
     db_path = DATABASE
     db_exists = os.path.exists(db_path)
     db_size = os.path.getsize(db_path) if db_exists else 0
     
-    # Get user counts
-    user_count = db.execute("SELECT COUNT(*) as count FROM users").fetchone()['count']
-    entry_count = db.execute("SELECT COUNT(*) as count FROM entries").fetchone()['count']
-    photo_count = db.execute("SELECT COUNT(*) as count FROM photos").fetchone()['count']
-    
-    # Get upload folder info
-    upload_files = len(os.listdir(UPLOAD_FOLDER)) if os.path.exists(UPLOAD_FOLDER) else 0
-    upload_size = sum(os.path.getsize(os.path.join(UPLOAD_FOLDER, f)) for f in os.listdir(UPLOAD_FOLDER) if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))) if os.path.exists(UPLOAD_FOLDER) else 0
+    # Get counts and upload folder info (cached, refreshed in the background)
+    stats = get_admin_stats()
+    if stats is None:
+        # The figures couldn't be gathered (the error is in the log); the rest of the page still works
+        user_count = entry_count = photo_count = upload_files = upload_size_text = "unavailable"
+    else:
+        user_count = stats['all_users']
+        entry_count = stats['total_entries']
+        photo_count = stats['total_photos']
+        upload_files = stats['upload_files']
+        # Convert to MB for readability
+        upload_size_text = f"{stats['upload_size'] / (1024 * 1024):.2f} MB"
     
-    # Convert to MB for readability
     db_size_mb = db_size / (1024 * 1024)
-    upload_size_mb = upload_size / (1024 * 1024)
+    
+    # Entries list cache (this worker only)
+    cache_stats = entries_cache.stats()
     
     status_html = f"""
     <!DOCTYPE html>
     <html>
     <head>
         <title>Database Status</title>
-        <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap" rel="stylesheet">
-        <style>
-            body {{
-                font-family: 'Poppins', sans-serif;
-                background: linear-gradient(135deg, #667eea, #764ba2);
-                padding: 20px;
-                color: white;
-            }}
-            .container {{
-                background: rgba(255,255,255,0.15);
-                backdrop-filter: blur(15px);
-                border-radius: 20px;
-                padding: 30px;
-                max-width: 800px;
-                margin: 0 auto;
-            }}
-            h1 {{ margin-bottom: 20px; }}
-            .stat-grid {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-                gap: 15px;
-                margin-bottom: 20px;
-            }}
-            .stat-card {{
-                background: rgba(255,255,255,0.2);
-                padding: 20px;
-                border-radius: 12px;
-            }}
-            .stat-value {{ font-size: 24px; font-weight: 600; }}
-            .stat-label {{ font-size: 14px; opacity: 0.8; }}
-            .info {{ margin-top: 20px; }}
-            .info-item {{ margin: 10px 0; }}
-            .back-btn {{
-                display: inline-block;
-                margin-top: 20px;
-                padding: 12px 24px;
-                background: #667eea;
-                color: white;
-                text-decoration: none;
-                border-radius: 10px;
-            }}
-        </style>
+        {FONT_HEAD}
+        {PWA_HEAD}
+        <link rel="stylesheet" href="{asset_url('css/db-status.css')}">
     </head>
     <body>
         <div class="container">
@@ -2538,10 +1625,16 @@ def db_status():
                 <div class="info-item">💾 Database Size: {db_size_mb:.2f} MB</div>
                 <div class="info-item">📸 Upload Folder: {UPLOAD_FOLDER}</div>
                 <div class="info-item">🖼️ Total Photos Files: {upload_files}</div>
-                <div class="info-item">📦 Photos Size: {upload_size_mb:.2f} MB</div>
+                <div class="info-item">📦 Photos Size: {upload_size_text}</div>
                 <div class="info-item">✅ Database Persistent: {'Yes' if '/data' in db_path else 'No'}</div>
             </div>
             
+            <div class="info">
+                <h3>⚡ Entries Cache (this worker)</h3>
+                <div class="info-item">🎯 Hit Rate: {cache_stats['hit_rate']:.1%} ({cache_stats['hits']} hits, {cache_stats['misses']} misses)</div>
+                <div class="info-item">🗂️ Cached Lists: {cache_stats['size']} / {cache_stats['max_size']}</div>
+            </div>
+            
             <a href="/admin" class="back-btn">← Back to Admin</a>
         </div>
     </body>
@@ -2550,6 +1643,595 @@ def db_status():
     
     return status_html
 
+# ---------------- RESPONSE COMPRESSION ----------------
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+# Dynamic responses use a fast Brotli level; static assets are compressed once at the maximum
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson', 'image/svg+xml', 'application/manifest+json',
+}
+COMPRESS_ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+
+def compress_bytes(data, encoding, static=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else COMPRESS_BROTLI_QUALITY)
+    return zlib.compress(data, 9 if static else COMPRESS_GZIP_LEVEL, wbits=31)
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed body chunk by chunk, flushing each so the client still receives it as it is produced"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+def negotiate_encoding():
+    return request.accept_encodings.best_match(COMPRESS_ENCODINGS)
+
+@app.after_request
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers or response.direct_passthrough):
+        return response
+    
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+    
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress_bytes(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# ---------------- STATIC ASSETS ----------------
+
+# Page styles and scripts live under static/ and are served under content-hashed names, so browsers
+# can cache them forever and a changed file simply gets a new URL
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_PRELOAD_TYPES = {'css': 'style', 'js': 'script'}
+
+def build_asset_manifest():
+    """{path under static/: fingerprinted path} for every static file"""
+    manifest = {}
+    for root, _, files in os.walk(STATIC_FOLDER):
+        for name in files:
+            filepath = os.path.join(root, name)
+            path = os.path.relpath(filepath, STATIC_FOLDER).replace(os.sep, '/')
+            with open(filepath, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            stem, ext = path.rsplit('.', 1)
+            manifest[path] = f"{stem}.{digest}.{ext}"
+    return manifest
+
+def build_asset_variants():
+    """Precompressed bodies of the compressible assets, {path: {encoding: bytes}}, built once at startup"""
+    variants = {}
+    for path in asset_manifest:
+        mimetype = mimetypes.guess_type(path)[0]
+        if mimetype not in COMPRESSIBLE_MIMETYPES:
+            continue
+        with open(os.path.join(STATIC_FOLDER, path), 'rb') as f:
+            data = f.read()
+        variants[path] = {encoding: compress_bytes(data, encoding, static=True) for encoding in COMPRESS_ENCODINGS}
+    return variants
+
+asset_manifest = build_asset_manifest()
+fingerprinted_assets = {hashed: path for path, hashed in asset_manifest.items()}
+asset_variants = build_asset_variants()
+
+def asset_url(path):
+    """URL of a static file; the asset is also announced in this response's Link preload header"""
+    url = "/assets/" + asset_manifest[path]
+    if path.rsplit('.', 1)[-1] in ASSET_PRELOAD_TYPES:
+        g.setdefault('preload_assets', []).append(url)
+    return url
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+# ---------------- FONTS ----------------
+
+# Poppins is served from static/fonts (built by `flask build-fonts`), subset to the Latin range.
+# The stylesheets' 600s resolve to the Bold face under the CSS font matching rules.
+FONT_WEIGHTS = {300: 'Light', 400: 'Regular', 700: 'Bold'}
+FONT_PRELOAD_WEIGHTS = (400, 700)
+FONT_UNICODE_RANGE = ("U+0000-00FF, U+0131, U+0152-0153, U+02BB-02BC, U+02C6, U+02DA, U+02DC, U+2000-206F, "
+                      "U+2074, U+20AC, U+2122, U+2190-2193, U+2212, U+2215, U+FEFF, U+FFFD")
+GOOGLE_FONTS_LINK = '<link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;700&display=swap" rel="stylesheet">'
+
+def font_path(weight):
+    return f"fonts/poppins-{weight}.woff2"
+
+def build_font_head():
+    """<head> markup loading Poppins: preloads and @font-face rules for the self-hosted files,
+    or the Google Fonts stylesheet if they haven't been built"""
+    if not all(font_path(weight) in asset_manifest for weight in FONT_WEIGHTS):
+        return Markup(GOOGLE_FONTS_LINK)
+    
+    links = [f'<link rel="preload" href="/assets/{asset_manifest[font_path(weight)]}" as="font" type="font/woff2" crossorigin>'
+             for weight in FONT_PRELOAD_WEIGHTS]
+    faces = [f"@font-face{{font-family:'Poppins';font-style:normal;font-weight:{weight};font-display:swap;"
+             f"src:url(/assets/{asset_manifest[font_path(weight)]}) format('woff2');unicode-range:{FONT_UNICODE_RANGE};}}"
+             for weight in FONT_WEIGHTS]
+    return Markup("\n".join(links) + "\n<style>\n" + "\n".join(faces) + "\n</style>")
+
+FONT_HEAD = build_font_head()
+app.jinja_env.globals['font_head'] = FONT_HEAD
+
+def parse_unicode_range(text):
+    """Code points covered by a CSS unicode-range value"""
+    codepoints = set()
+    for part in text.split(","):
+        start, _, end = part.strip()[2:].partition("-")
+        codepoints.update(range(int(start, 16), int(end or start, 16) + 1))
+    return codepoints
+
+@app.cli.command("build-fonts")
+@click.argument("source_dir", type=click.Path(exists=True, file_okay=False))
+def build_fonts_command(source_dir):
+    """Subset the Poppins TTFs in SOURCE_DIR (Poppins-Light.ttf etc. from Google Fonts) into static/fonts."""
+    try:
+        from fontTools import subset
+    except ImportError:
+        raise click.ClickException("fonttools is needed to build fonts: pip install fonttools brotli")
+    
+    os.makedirs(os.path.join(STATIC_FOLDER, "fonts"), exist_ok=True)
+    unicodes = parse_unicode_range(FONT_UNICODE_RANGE)
+    for weight, style in FONT_WEIGHTS.items():
+        source = os.path.join(source_dir, f"Poppins-{style}.ttf")
+        target = os.path.join(STATIC_FOLDER, font_path(weight))
+        options = subset.Options()
+        options.flavor = "woff2"
+        options.layout_features = ["kern", "liga", "calt"]
+        options.name_IDs = ["*"]
+        font = subset.load_font(source, options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=unicodes)
+        subsetter.subset(font)
+        subset.save_font(font, target, options)
+        click.echo(f"{font_path(weight)}: {os.path.getsize(source) // 1024} KB -> {os.path.getsize(target) // 1024} KB")
+
+@app.after_request
+def add_preload_header(response):
+    # Lets the browser start fetching styles and scripts before it has parsed the HTML
+    preload = g.pop('preload_assets', None)
+    if preload:
+        response.headers['Link'] = ", ".join(
+            f"<{url}>; rel=preload; as={ASSET_PRELOAD_TYPES[url.rsplit('.', 1)[-1]]}" for url in preload
+        )
+    return response
+
+@app.route("/assets/<path:filename>")
+def asset(filename):
+    path = fingerprinted_assets.get(filename)
+    if path:
+        encoding = negotiate_encoding() if path in asset_variants else None
+        if encoding:
+            response = Response(asset_variants[path][encoding], mimetype=mimetypes.guess_type(path)[0])
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(f"{filename}-{encoding}")
+            response.make_conditional(request)
+        else:
+            response = send_from_directory(STATIC_FOLDER, path, max_age=ASSET_MAX_AGE)
+        response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+        return response
+    
+    # A fingerprint from before a deploy still gets the current file, just without long-term caching
+    parts = filename.rsplit('.', 2)
+    if len(parts) == 3 and f"{parts[0]}.{parts[2]}" in asset_manifest:
+        return send_from_directory(STATIC_FOLDER, f"{parts[0]}.{parts[2]}", max_age=0)
+    return "Not found", 404
+
+# ---------------- PWA ----------------
+
+# The service worker caches the app shell, recently read pages and photos, and queues entry
+# saves made offline (static/js/sw.js); its cache version follows the asset fingerprints
+PWA_THEME_COLOR = "#667eea"
+
+PWA_HEAD = Markup(
+    f'<link rel="manifest" href="/manifest.webmanifest">\n'
+    f'<meta name="theme-color" content="{PWA_THEME_COLOR}">\n'
+    f'<link rel="apple-touch-icon" href="/assets/{asset_manifest["icons/icon-180.png"]}">\n'
+    f'<script src="/assets/{asset_manifest["js/pwa.js"]}" defer></script>'
+)
+app.jinja_env.globals['pwa_head'] = PWA_HEAD
+
+def build_service_worker():
+    precache = ["/offline", "/offline?queued=1"] + [
+        "/assets/" + hashed for path, hashed in sorted(asset_manifest.items()) if path != "js/sw.js"
+    ]
+    version = hashlib.sha256("\n".join(precache).encode()).hexdigest()[:12]
+    with open(os.path.join(STATIC_FOLDER, "js", "sw.js")) as f:
+        source = f.read()
+    return source.replace("__VERSION__", version).replace("__PRECACHE__", json.dumps(precache))
+
+SERVICE_WORKER_JS = build_service_worker()
+
+@app.route("/sw.js")
+def service_worker():
+    # Served from the root so it controls every page; browsers re-check it on each visit
+    response = Response(SERVICE_WORKER_JS, mimetype="text/javascript")
+    response.headers['Cache-Control'] = "no-cache"
+    return response
+
+@app.route("/manifest.webmanifest")
+def web_manifest():
+    manifest = {
+        'name': "Personal Diary",
+        'short_name': "Diary",
+        'start_url': "/entries",
+        'scope': "/",
+        'display': "standalone",
+        'background_color': PWA_THEME_COLOR,
+        'theme_color': PWA_THEME_COLOR,
+        'icons': [
+            {'src': f"/assets/{asset_manifest['icons/icon-192.png']}", 'sizes': "192x192", 'type': "image/png", 'purpose': "any maskable"},
+            {'src': f"/assets/{asset_manifest['icons/icon-512.png']}", 'sizes': "512x512", 'type': "image/png", 'purpose': "any maskable"},
+        ],
+    }
+    return Response(json.dumps(manifest), mimetype="application/manifest+json")
+
+@app.route("/offline")
+def offline_page():
+    return render_template_string(OFFLINE_PAGE, queued=bool(request.args.get("queued")))
+
+# ---------------- ENTRIES LIST CACHE ----------------
+
+ENTRIES_CACHE_SIZE = int(os.environ.get('ENTRIES_CACHE_SIZE', 512))
+
+class FragmentCache:
+    """Bounded LRU of rendered fragments, one slot per user, valid for a single generation"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, generation):
+        with self.lock:
+            item = self.items.get(user_id)
+            if item is None or item[0] != generation:
+                self.misses += 1
+                return None
+            self.items.move_to_end(user_id)
+            self.hits += 1
+            return item[1]
+
+    def put(self, user_id, generation, html):
+        with self.lock:
+            self.items[user_id] = (generation, html)
+            self.items.move_to_end(user_id)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.items.pop(user_id, None)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self.items),
+                'max_size': self.max_size,
+            }
+
+entries_cache = FragmentCache(ENTRIES_CACHE_SIZE)
+
+# ---------------- ADMIN USER DIRECTORY ----------------
+
+ADMIN_PAGE_SIZE = 50
+
+# ---------------- ADMIN STATS CACHE ----------------
+
+ADMIN_STATS_REFRESH_SECONDS = int(os.environ.get('ADMIN_STATS_REFRESH_SECONDS', 300))
+
+# Last computed dashboard figures; served as-is while a refresh runs in the background
+admin_stats = {'data': None, 'computed_at': 0.0, 'refreshing': False}
+admin_stats_lock = threading.Lock()
+
+def compute_admin_stats():
+    """Gather dashboard figures on a private connection (runs off the request path)"""
+    db = connect_db()
+    try:
+        stats = repository.get_user_totals(db)
+    finally:
+        db.close()
+    
+    upload_files = 0
+    upload_size = 0
+    if os.path.exists(UPLOAD_FOLDER):
+        with os.scandir(UPLOAD_FOLDER) as it:
+            for item in it:
+                if item.is_file():
+                    upload_files += 1
+                    upload_size += item.stat().st_size
+    
+    stats.update(upload_files=upload_files, upload_size=upload_size)
+    return stats
+
+def refresh_admin_stats():
+    try:
+        data = compute_admin_stats()
+        with admin_stats_lock:
+            admin_stats['data'] = data
+            admin_stats['computed_at'] = time.time()
+    except Exception:
+        app.logger.exception("Admin stats refresh failed")
+    finally:
+        with admin_stats_lock:
+            admin_stats['refreshing'] = False
+
+def get_admin_stats():
+    """Dashboard figures, at most ADMIN_STATS_REFRESH_SECONDS stale; only the very first call waits for a query
+
+    Returns None while no snapshot has been computed successfully (the failure is logged); the next call retries.
+    """
+    with admin_stats_lock:
+        data = admin_stats['data']
+        stale = time.time() - admin_stats['computed_at'] > ADMIN_STATS_REFRESH_SECONDS
+        start_refresh = data is not None and stale and not admin_stats['refreshing']
+        if start_refresh:
+            admin_stats['refreshing'] = True
+    
+    if data is None:
+        with admin_stats_lock:
+            admin_stats['refreshing'] = True
+        refresh_admin_stats()
+        with admin_stats_lock:
+            return admin_stats['data']
+    
+    if start_refresh:
+        threading.Thread(target=refresh_admin_stats, daemon=True).start()
+    return data
+
+# ---------------- ACCOUNT PURGE ----------------
+
+# Deleting a big account in one statement holds the write lock for the whole cascade, so deleted
+# accounts are purged a batch at a time with a pause in between to let other writers in
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 200))
+PURGE_PAUSE_SECONDS = float(os.environ.get('PURGE_PAUSE_SECONDS', 0.05))
+
+purge_lock = threading.Lock()
+purge_state = {'running': False}
+
+def purge_account(db, user_id):
+    """Delete one soft-deleted account's photos, then entries, then the user row, committing per batch"""
+    while True:
+        filenames = repository.delete_user_photos_batch(db, user_id, PURGE_BATCH_SIZE)
+        db.commit()
+        # Files go only after the rows are gone, so no committed row ever points at a missing file
+        discard_uploads(filenames)
+        if not filenames:
+            break
+        time.sleep(PURGE_PAUSE_SECONDS)
+    
+    while repository.delete_user_entries_batch(db, user_id, PURGE_BATCH_SIZE):
+        db.commit()
+        time.sleep(PURGE_PAUSE_SECONDS)
+    
+    # Anything written in the meantime goes with the (now small) cascade
+    repository.delete_user(db, user_id)
+    db.commit()
+    entries_cache.discard(user_id)
+
+def run_account_purge():
+    try:
+        while True:
+            db = connect_db()
+            try:
+                user_ids = repository.get_deleted_user_ids(db)
+                for user_id in user_ids:
+                    print(f"Purging deleted account {user_id}...")
+                    purge_account(db, user_id)
+            finally:
+                db.close()
+            
+            # Accounts deleted while this pass ran are picked up before the worker exits
+            with purge_lock:
+                if not user_ids:
+                    purge_state['running'] = False
+                    return
+    except Exception as e:
+        print(f"Account purge failed: {e}")
+        with purge_lock:
+            purge_state['running'] = False
+
+def start_account_purge():
+    """Run the purge worker unless one is already running in this process"""
+    with purge_lock:
+        if purge_state['running']:
+            return
+        purge_state['running'] = True
+    threading.Thread(target=run_account_purge, daemon=True).start()
+
+# ---------------- PHOTO INGEST ----------------
+
+# Uploads are written under this prefix first and renamed into place only once complete
+STAGING_PREFIX = ".staging-"
+
+# Ingest-time recompression (needs Pillow): fix orientation, drop metadata, cap the long edge
+PHOTO_RECOMPRESS = os.environ.get('PHOTO_RECOMPRESS', '1').lower() in ('1', 'true', 'yes')
+PHOTO_MAX_EDGE = int(os.environ.get('PHOTO_MAX_EDGE', 2048))
+PHOTO_JPEG_QUALITY = int(os.environ.get('PHOTO_JPEG_QUALITY', 82))
+PHOTO_KEEP_ORIGINALS = os.environ.get('PHOTO_KEEP_ORIGINALS', '0').lower() in ('1', 'true', 'yes')
+ORIGINALS_FOLDER = os.path.join(UPLOAD_FOLDER, 'originals')
+
+if PHOTO_KEEP_ORIGINALS:
+    os.makedirs(ORIGINALS_FOLDER, exist_ok=True)
+
+def staging_path(filename):
+    return os.path.join(UPLOAD_FOLDER, STAGING_PREFIX + filename)
+
+def new_upload_name(original_name):
+    """Unique stored filename that keeps the upload's extension"""
+    ext = original_name.rsplit('.', 1)[-1].lower() if '.' in original_name else 'jpg'
+    ext = ''.join(ch for ch in ext if ch.isalnum())[:10] or 'jpg'
+    return f"{uuid.uuid4().hex}.{ext}"
+
+def stage_uploads(files):
+    """Write every uploaded file to a staging name; returns the stored filenames"""
+    staged = []
+    try:
+        for file in files:
+            if file and file.filename:
+                filename = new_upload_name(file.filename)
+                staged.append(filename)
+                file.save(staging_path(filename))
+                staged[-1] = recompress_staged_photo(filename)
+    except Exception:
+        discard_uploads(staged)
+        raise
+    return staged
+
+def recompress_staged_photo(filename):
+    """Re-encode a staged upload in place; returns its (possibly new) stored filename
+    
+    Anything Pillow cannot decode, and animated images, are left untouched.
+    """
+    if not PHOTO_RECOMPRESS or Image is None:
+        return filename
+    
+    src = staging_path(filename)
+    stem = filename.rsplit('.', 1)[0]
+    try:
+        with Image.open(src) as img:
+            if getattr(img, 'is_animated', False):
+                return filename
+            # Let the JPEG decoder downscale while reading instead of decoding full size
+            img.draft('RGB', (PHOTO_MAX_EDGE, PHOTO_MAX_EDGE))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((PHOTO_MAX_EDGE, PHOTO_MAX_EDGE))
+            
+            buf = io.BytesIO()
+            if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+                out_name = f"{stem}.png"
+                img.convert('RGBA').save(buf, 'PNG', optimize=True)
+            else:
+                out_name = f"{stem}.jpg"
+                img.convert('RGB').save(buf, 'JPEG', quality=PHOTO_JPEG_QUALITY, optimize=True, progressive=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return filename
+    
+    if PHOTO_KEEP_ORIGINALS:
+        os.replace(src, os.path.join(ORIGINALS_FOLDER, filename))
+    elif out_name != filename:
+        os.remove(src)
+    with open(staging_path(out_name), 'wb') as f:
+        f.write(buf.getbuffer())
+    return out_name
+
+# Long edge, in pixels, of the blurred preview inlined into pages while the real photo loads
+PLACEHOLDER_EDGE = 16
+
+def photo_preview(filepath):
+    """(width, height, placeholder data URI) for a stored photo
+    
+    Returns (0, 0, None) for files Pillow cannot decode so they are not retried,
+    and (None, None, None) when Pillow is not installed.
+    """
+    if Image is None:
+        return None, None, None
+    try:
+        with Image.open(filepath) as img:
+            width, height = img.size
+            img.draft('RGB', (PLACEHOLDER_EDGE, PLACEHOLDER_EDGE))
+            img = img.convert('RGB')
+            img.thumbnail((PLACEHOLDER_EDGE, PLACEHOLDER_EDGE))
+            buf = io.BytesIO()
+            img.save(buf, 'JPEG', quality=40, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return 0, 0, None
+    return width, height, "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode('ascii')
+
+def publish_uploads(staged):
+    """Atomically rename staged files to their final names
+    
+    Returns (filename, size_bytes, width, height, placeholder) tuples for repository.add_photos.
+    """
+    photos = []
+    for filename in staged:
+        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        os.replace(staging_path(filename), filepath)
+        photos.append((filename, os.path.getsize(filepath)) + photo_preview(filepath))
+    return photos
+
+def discard_uploads(filenames):
+    """Remove staged and/or published files after a failed ingest"""
+    # A kept original shares the stem but may not share the extension; list the folder once per call
+    originals = {}
+    if filenames and PHOTO_KEEP_ORIGINALS:
+        for name in os.listdir(ORIGINALS_FOLDER):
+            originals.setdefault(name.rsplit('.', 1)[0], []).append(os.path.join(ORIGINALS_FOLDER, name))
+    for filename in filenames:
+        stem = filename.rsplit('.', 1)[0]
+        for path in [staging_path(filename), os.path.join(UPLOAD_FOLDER, filename)] + originals.get(stem, []):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def cleanup_staged_uploads(max_age_seconds=3600):
+    """Delete staging files left behind by a crash mid-upload"""
+    cutoff = time.time() - max_age_seconds
+    with os.scandir(UPLOAD_FOLDER) as it:
+        for item in it:
+            if item.name.startswith(STAGING_PREFIX) and item.stat().st_mtime < cutoff:
+                try:
+                    os.remove(item.path)
+                except OSError:
+                    pass
+
+cleanup_staged_uploads()
+
+# Pick up accounts whose purge was interrupted by a restart
+start_account_purge()
+
+# ---------------- DATES ----------------
+
+def parse_entry_date(value):
+    """Normalize an entry date to YYYY-MM-DD (so it sorts and ranges correctly), or None if it isn't one"""
+    if not value:
+        return None
+    value = str(value).strip()
+    for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d", "%d-%m-%Y", "%d/%m/%Y"):
+        try:
+            # isoformat pads the year to four digits, which strftime doesn't for years before 1000
+            return datetime.strptime(value[:19], fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def heat_level(count, busiest):
+    """0-4 shade for a heatmap cell, relative to the busiest cell"""
+    if not count or not busiest:
+        return 0
+    return max(1, min(4, -(-count * 4 // busiest)))
+
 # ---------------- ROUTES ----------------
 
 @app.route("/")
@@ -2562,6 +2244,23 @@ def home():
         return redirect("/admin")
     return redirect("/entries")
 
+def encode_user_cursor(sort, row):
+    key = json.dumps([sort, row['sort_key'], row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_user_cursor(cursor, sort):
+    """(sort_key, id) from an admin directory cursor made for `sort`, else None"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, key, user_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        return None
+    if cursor_sort != sort or isinstance(key, bool) or not isinstance(key, (str, int)):
+        return None
+    return (key, int(user_id))
+
 @app.route("/admin")
 def admin_panel():
     if not session.get("user") or not session.get("is_admin"):
@@ -2569,45 +2268,47 @@ def admin_panel():
     
     db = get_db()
     
-    # Get all users except admin
-    users = db.execute("""
-        SELECT u.*, 
-               (SELECT COUNT(*) FROM entries WHERE user_id = u.id) as entry_count,
-               (SELECT COUNT(*) FROM photos p JOIN entries e ON p.entry_id = e.id WHERE e.user_id = u.id) as photo_count
-        FROM users u 
-        WHERE u.username != 'admin' 
-        ORDER BY u.created_at DESC
-    """).fetchall()
-    
-    # Get statistics
-    total_users = db.execute("SELECT COUNT(*) as count FROM users WHERE username != 'admin'").fetchone()['count']
-    total_entries = db.execute("SELECT COUNT(*) as count FROM entries").fetchone()['count']
-    total_photos = db.execute("SELECT COUNT(*) as count FROM photos").fetchone()['count']
-    
-    # New users today
-    new_users_today = db.execute("""
-        SELECT COUNT(*) as count FROM users 
-        WHERE date(created_at) = date('now') AND username != 'admin'
-    """).fetchone()['count']
+    # Directory filters come from the query string so pages can be linked and bookmarked
+    search = request.args.get("q", "").strip()
+    # Search results read A to Z unless another order is picked
+    sort = request.args.get("sort", "name" if search else "joined")
+    if sort not in repository.USER_SORT_COLUMNS:
+        sort = "joined"
+    # A cursor from another sort (or a mangled one) just starts from the first page
+    after = decode_user_cursor(request.args.get("after"), sort)
+    before = None if after else decode_user_cursor(request.args.get("before"), sort)
+    
+    users, has_more = repository.search_users(db, search, sort, ADMIN_PAGE_SIZE, after=after, before=before)
+    has_prev = bool(users) and (has_more if before else after is not None)
+    has_next = bool(users) and (has_more if not before else True)
+    
+    # Get statistics (cached, refreshed in the background)
+    stats = get_admin_stats()
+    if stats is None:
+        # The figures couldn't be gathered (the error is in the log); the directory still works
+        stats = dict.fromkeys(('total_users', 'total_entries', 'total_photos', 'new_users_today'), '—')
     
     return render_template_string(ADMIN_PANEL_PAGE, 
                                 users=users,
-                                total_users=total_users,
-                                total_entries=total_entries,
-                                total_photos=total_photos,
-                                new_users_today=new_users_today)
+                                search=search,
+                                sort=sort,
+                                prev_cursor=encode_user_cursor(sort, users[0]) if has_prev else None,
+                                next_cursor=encode_user_cursor(sort, users[-1]) if has_next else None,
+                                total_users=stats['total_users'],
+                                total_entries=stats['total_entries'],
+                                total_photos=stats['total_photos'],
+                                new_users_today=stats['new_users_today'])
 
 @app.route("/admin_delete/<int:id>")
 def admin_delete(id):
     if not session.get("user") or not session.get("is_admin"):
         return redirect("/")
     
-    db = get_db()
-    
     try:
-        # Delete user (entries and photos will be deleted automatically due to CASCADE)
-        db.execute("DELETE FROM users WHERE id = ? AND username != 'admin'", (id,))
-        db.commit()
+        # Hide the account now; its entries, photos and files are purged in small batches in the background
+        if run_write(repository.soft_delete_user, id):
+            entries_cache.discard(id)
+            start_account_purge()
     except Exception as e:
         print(f"Error deleting user: {e}")
     
@@ -2620,16 +2321,84 @@ def entries_list():
     
     db = get_db()
     
-    # Get entries for the user
-    entries = db.execute("""
-        SELECT id, date, 
-               substr(content, 1, 40) as preview 
-        FROM entries 
-        WHERE user_id = ? 
-        ORDER BY date DESC, created_at DESC
-    """, (session["user_id"],)).fetchall()
+    # Optional date range; invalid dates are ignored
+    date_from = parse_entry_date(request.args.get("from"))
+    date_to = parse_entry_date(request.args.get("to"))
+    
+    if date_from or date_to:
+        # Range queries are served straight from the (user_id, date) index; only the full list is cached
+        entries = repository.list_entries(db, session["user_id"], date_from=date_from, date_to=date_to)
+        entries_html = render_template_string(ENTRIES_LIST_FRAGMENT, entries=entries, filtered=True)
+    else:
+        # The generation lives in the database, so a write in any worker invalidates this one's copy
+        generation = repository.get_entries_generation(db, session["user_id"])
+        entries_html = entries_cache.get(session["user_id"], generation)
+        
+        if entries_html is None:
+            # Get entries for the user
+            entries = repository.list_entries(db, session["user_id"])
+            entries_html = render_template_string(ENTRIES_LIST_FRAGMENT, entries=entries)
+            if generation is not None:
+                entries_cache.put(session["user_id"], generation, entries_html)
+    
+    return render_template_string(ENTRIES_PAGE, entries_html=Markup(entries_html),
+                                date_from=date_from, date_to=date_to)
+
+@app.route("/calendar")
+def calendar_view():
+    if not session.get("user"):
+        return redirect("/")
+    
+    # Month to show, as YYYY-MM (defaults to the current month). The grid spills into the
+    # neighbouring months, so the first and last years date can represent are left out.
+    try:
+        month_start = datetime.strptime(request.args.get("month", ""), "%Y-%m").date()
+        if not 1 < month_start.year < 9999:
+            raise ValueError
+    except ValueError:
+        month_start = datetime.now().date().replace(day=1)
+    
+    weeks = calendar.Calendar(firstweekday=0).monthdatescalendar(month_start.year, month_start.month)
+    first_day, last_day = weeks[0][0], weeks[-1][-1]
     
-    return render_template_string(ENTRIES_PAGE, entries=entries)
+    db = get_db()
+    # Both heatmaps are GROUP BY aggregates over the (user_id, date) index
+    day_counts = repository.count_entries_by_day(db, session["user_id"], first_day.isoformat(), last_day.isoformat())
+    month_counts = repository.count_entries_by_month(db, session["user_id"], month_start.year)
+    
+    busiest_day = max(day_counts.values(), default=0)
+    days = []
+    for week in weeks:
+        for day in week:
+            count = day_counts.get(day.isoformat(), 0)
+            days.append({
+                'date': day.isoformat(),
+                'day': day.day,
+                'count': count,
+                'level': heat_level(count, busiest_day),
+                'outside': day.month != month_start.month,
+            })
+    
+    busiest_month = max(month_counts.values(), default=0)
+    months = []
+    for number in range(1, 13):
+        key = f"{month_start.year:04d}-{number:02d}"
+        count = month_counts.get(key, 0)
+        months.append({'key': key, 'name': calendar.month_abbr[number], 'count': count,
+                       'level': heat_level(count, busiest_month)})
+    
+    prev_month = (month_start - timedelta(days=1)).isoformat()[:7]
+    next_month = (month_start.replace(day=28) + timedelta(days=4)).isoformat()[:7]
+    
+    return render_template_string(CALENDAR_PAGE,
+                                days=days,
+                                months=months,
+                                year=month_start.year,
+                                year_total=sum(month_counts.values()),
+                                month_key=month_start.isoformat()[:7],
+                                month_name=month_start.strftime("%B %Y"),
+                                prev_month=prev_month,
+                                next_month=next_month)
 
 @app.route("/signup", methods=["POST"])
 def signup():
@@ -2649,11 +2418,9 @@ def signup():
                                     message_type="error",
                                     active_tab='signup')
     
-    db = get_db()
+    password_hash = generate_password_hash(password)
     try:
-        db.execute("INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
-                   (username, generate_password_hash(password), email))
-        db.commit()
+        run_write(repository.create_user, username, password_hash, email)
         return render_template_string(LOGIN_TEMPLATE, 
                                     message="Account created! Please login.", 
                                     message_type="success",
@@ -2676,10 +2443,9 @@ def login():
     password = request.form["password"]
     
     db = get_db()
-    user = db.execute("SELECT * FROM users WHERE username = ?",
-                      (username,)).fetchone()
+    user = repository.get_user_by_username(db, username)
     
-    if user and check_password_hash(user["password"], password):
+    if user and not user["deleted_at"] and check_password_hash(user["password"], password):
         session["user"] = user["username"]
         session["user_id"] = user["id"]
         session["is_admin"] = (user["username"] == "admin")
@@ -2705,9 +2471,9 @@ def admin_login(id):
         return redirect("/")
     
     db = get_db()
-    user = db.execute("SELECT * FROM users WHERE id = ?", (id,)).fetchone()
+    user = repository.get_user_by_id(db, id)
     
-    if user:
+    if user and not user["deleted_at"]:
         session["user"] = user["username"]
         session["user_id"] = user["id"]
         session["is_admin"] = False  # Demote to normal user
@@ -2739,16 +2505,14 @@ def change_password():
                                     message_type="error")
     
     db = get_db()
-    user = db.execute("SELECT * FROM users WHERE id = ?", (session["user_id"],)).fetchone()
+    user = repository.get_user_by_id(db, session["user_id"])
     
     if not check_password_hash(user["password"], current_password):
         return render_template_string(CHANGE_PASSWORD_PAGE,
                                     message="Current password is incorrect",
                                     message_type="error")
     
-    db.execute("UPDATE users SET password = ? WHERE id = ?",
-              (generate_password_hash(new_password), session["user_id"]))
-    db.commit()
+    run_write(repository.update_password, session["user_id"], generate_password_hash(new_password))
     
     return render_template_string(CHANGE_PASSWORD_PAGE,
                                 message="Password changed successfully!",
@@ -2763,7 +2527,7 @@ def forgot_password():
     email = request.form["email"]
     
     db = get_db()
-    user = db.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+    user = repository.get_user_by_email(db, email)
     
     if not user:
         return render_template_string(FORGOT_PASSWORD_PAGE,
@@ -2834,7 +2598,7 @@ def resend_otp():
     email = request.form["email"]
     
     db = get_db()
-    user = db.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+    user = repository.get_user_by_email(db, email)
     
     if not user:
         return render_template_string(FORGOT_PASSWORD_PAGE,
@@ -2894,10 +2658,7 @@ def reset_password():
     
     user_id = otp_storage[email]['user_id']
     
-    db = get_db()
-    db.execute("UPDATE users SET password = ? WHERE id = ?",
-              (generate_password_hash(new_password), user_id))
-    db.commit()
+    run_write(repository.update_password, user_id, generate_password_hash(new_password))
     
     # Clear OTP
     if email in otp_storage:
@@ -2914,12 +2675,23 @@ def new_entry():
         return redirect("/")
     
     today = datetime.now().strftime("%Y-%m-%d")
-    return render_template_string(NEW_ENTRY_PAGE, today=today)
+    draft = repository.get_draft(get_db(), session["user_id"], 0)
+    return render_template_string(NEW_ENTRY_PAGE, today=today, draft=draft)
+
+def posted_by_other_account():
+    """True when the form was filled in by an account other than the one now signed in
+
+    Saves made offline are replayed by the service worker later, possibly after someone else signed in.
+    """
+    account = request.form.get("account", type=int)
+    return account is not None and account != session["user_id"]
 
 @app.route("/save", methods=["POST"])
 def save_entry():
     if not session.get("user"):
         return redirect("/")
+    if posted_by_other_account():
+        return "This entry was written while signed in to another account", 403
     
     date = request.form["date"]
     content = request.form["content"]
@@ -2930,32 +2702,33 @@ def save_entry():
                                     message="Date and content are required",
                                     today=datetime.now().strftime("%Y-%m-%d"))
     
-    db = get_db()
+    date = parse_entry_date(date)
+    if not date:
+        return render_template_string(NEW_ENTRY_PAGE,
+                                    message="Please enter a valid date",
+                                    today=datetime.now().strftime("%Y-%m-%d"))
     
-    # Insert entry
-    cursor = db.execute(
-        "INSERT INTO entries (user_id, date, content) VALUES (?, ?, ?)",
-        (session["user_id"], date, content)
-    )
-    db.commit()
+    user_id = session["user_id"]
     
-    entry_id = cursor.lastrowid
+    # Write photos to staging names first; nothing is visible until the commit below
+    staged = stage_uploads(files)
     
-    # Save photos
-    if files:
-        for file in files:
-            if file and file.filename:
-                # Generate unique filename
-                ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                filename = f"{uuid.uuid4().hex}.{ext}"
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(filepath)
-                
-                db.execute(
-                    "INSERT INTO photos (entry_id, filename) VALUES (?, ?)",
-                    (entry_id, filename)
-                )
-        db.commit()
+    def write(db):
+        # Insert entry and all its photos in one transaction
+        entry_id = repository.insert_entry(db, user_id, date, content)
+        repository.add_photos(db, user_id, entry_id, photos)
+        # The autosaved draft is published now
+        repository.delete_draft(db, user_id, 0)
+        return entry_id
+    
+    try:
+        # Files are renamed into place before the commit, so a crash can leave an
+        # unreferenced file behind but never a photo row without its file
+        photos = publish_uploads(staged)
+        entry_id = run_write(write)
+    except Exception:
+        discard_uploads(staged)
+        raise
     
     return render_template_string(SUCCESS_PAGE,
                                 message="Entry saved successfully!",
@@ -2969,23 +2742,35 @@ def view_entry(id):
     
     db = get_db()
     
-    # Get entry
-    entry = db.execute(
-        "SELECT * FROM entries WHERE id = ? AND user_id = ?",
-        (id, session["user_id"])
-    ).fetchone()
+    # Get entry and its photos in one query
+    entry, photos = repository.get_entry_with_photos(db, session["user_id"], id)
     
     if not entry:
         return redirect("/entries")
     
-    # Get photos for this entry
-    photos = db.execute(
-        "SELECT * FROM photos WHERE entry_id = ?",
-        (id,)
-    ).fetchall()
-    
     return render_template_string(VIEW_ENTRY_PAGE, entry=entry, photos=photos)
 
+@app.route("/view/<int:id>/history")
+def entry_history(id):
+    if not session.get("user"):
+        return redirect("/")
+    
+    db = get_db()
+    entry = repository.get_entry(db, session["user_id"], id)
+    if not entry:
+        return redirect("/entries")
+    
+    revisions = repository.list_revisions(db, id)
+    selected = None
+    version = request.args.get("version", type=int)
+    if version is not None:
+        content = repository.get_revision_content(db, entry, version)
+        if content is not None:
+            selected = dict(next(r for r in revisions if r['version'] == version), content=content)
+    
+    return render_template_string(HISTORY_PAGE, entry=entry, revisions=revisions, selected=selected,
+                                missing=version is not None and selected is None)
+
 @app.route("/edit/<int:id>")
 def edit_entry(id):
     if not session.get("user"):
@@ -2993,27 +2778,29 @@ def edit_entry(id):
     
     db = get_db()
     
-    # Get entry
-    entry = db.execute(
-        "SELECT * FROM entries WHERE id = ? AND user_id = ?",
-        (id, session["user_id"])
-    ).fetchone()
+    # Get entry and its photos in one query
+    entry, photos = repository.get_entry_with_photos(db, session["user_id"], id)
     
     if not entry:
         return redirect("/entries")
     
-    # Get photos
-    photos = db.execute(
-        "SELECT * FROM photos WHERE entry_id = ?",
-        (id,)
-    ).fetchall()
+    # Unsaved changes from an earlier visit take over the form; it keeps the version they started
+    # from, so saving them over a version written since then is caught as a conflict
+    draft = repository.get_draft(db, session["user_id"], id)
+    if draft:
+        draft['entry_version'] = entry['version']
+        entry.update(date=draft['date'] or entry['date'], content=draft['content'])
+        if draft['base_version'] is not None:
+            entry['version'] = draft['base_version']
     
-    return render_template_string(EDIT_ENTRY_PAGE, entry=entry, photos=photos)
+    return render_template_string(EDIT_ENTRY_PAGE, entry=entry, photos=photos, draft=draft)
 
 @app.route("/update/<int:id>", methods=["POST"])
 def update_entry(id):
     if not session.get("user"):
         return redirect("/")
+    if posted_by_other_account():
+        return "This edit was made while signed in to another account", 403
     
     date = request.form["date"]
     content = request.form["content"]
@@ -3021,36 +2808,48 @@ def update_entry(id):
     
     db = get_db()
     
-    # Check if entry exists and belongs to user
-    entry = db.execute(
-        "SELECT * FROM entries WHERE id = ? AND user_id = ?",
-        (id, session["user_id"])
-    ).fetchone()
-    
-    if not entry:
-        return redirect("/entries")
-    
-    # Update entry
-    db.execute(
-        "UPDATE entries SET date = ?, content = ? WHERE id = ?",
-        (date, content, id)
-    )
-    db.commit()
+    date = parse_entry_date(date)
+    if not date:
+        entry, photos = repository.get_entry_with_photos(db, session["user_id"], id)
+        if not entry:
+            return redirect("/entries")
+        return render_template_string(EDIT_ENTRY_PAGE, entry=entry, photos=photos,
+                                    message="Please enter a valid date")
+    
+    user_id = session["user_id"]
+    # The version the form was loaded at; forms from before versioning skip the check
+    version = request.form.get("version", type=int)
+    
+    # Write new photos to staging names first
+    staged = stage_uploads(files)
+    
+    def write(db):
+        # Update entry (the update itself checks that it belongs to the user and is still at `version`)
+        if not repository.update_entry(db, user_id, id, date, content, version=version):
+            return False
+        # Save new photos if any, in the same transaction as the update
+        repository.add_photos(db, user_id, id, photos)
+        repository.delete_draft(db, user_id, id)
+        return True
     
-    # Save new photos if any
-    if files:
-        for file in files:
-            if file and file.filename:
-                ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else 'jpg'
-                filename = f"{uuid.uuid4().hex}.{ext}"
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(filepath)
-                
-                db.execute(
-                    "INSERT INTO photos (entry_id, filename) VALUES (?, ?)",
-                    (id, filename)
-                )
-        db.commit()
+    try:
+        photos = publish_uploads(staged)
+        updated = run_write(write)
+    except Exception:
+        discard_uploads(staged)
+        raise
+    
+    if not updated:
+        discard_uploads(staged)
+        entry, photos = repository.get_entry_with_photos(db, user_id, id)
+        if not entry:
+            return redirect("/entries")
+        # Saved elsewhere since this form was opened: show the user's text against the newer version
+        entry.update(date=date, content=content)
+        return render_template_string(EDIT_ENTRY_PAGE, entry=entry, photos=photos,
+                                    message="This entry was changed in another tab or device since you opened it. "
+                                            "Your text is below; saving again will replace the newer version "
+                                            "(new photos need to be added again)."), 409
     
     return redirect(f"/view/{id}")
 
@@ -3059,14 +2858,8 @@ def delete_entry(id):
     if not session.get("user"):
         return redirect("/")
     
-    db = get_db()
-    
     # Delete entry (photos will be deleted automatically due to CASCADE)
-    db.execute(
-        "DELETE FROM entries WHERE id = ? AND user_id = ?",
-        (id, session["user_id"])
-    )
-    db.commit()
+    run_write(repository.delete_entry, session["user_id"], id)
     
     return redirect("/entries")
 
@@ -3074,6 +2867,1118 @@ def delete_entry(id):
 def uploaded_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename)
 
+# ---------------- EXPORT ----------------
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+class _StreamBuffer:
+    """Write-only file object that zipfile writes into and the generator drains"""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_jsonl(db, user_id):
+    """Stream the diary as JSON Lines, one entry per line"""
+    for entry in repository.iter_entries_for_export(db, user_id):
+        yield (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+def export_zip(db, user_id):
+    """Stream the diary as a ZIP: entries.jsonl plus every referenced photo under photos/"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        filenames = []
+        with archive.open("entries.jsonl", "w", force_zip64=True) as out:
+            for entry in repository.iter_entries_for_export(db, user_id):
+                filenames.extend(entry['photos'])
+                out.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+                data = buffer.drain()
+                if data:
+                    yield data
+        yield buffer.drain()
+
+        # Photos are already compressed, so store them as-is and read them in chunks
+        for filename in filenames:
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            if not os.path.isfile(filepath):
+                continue
+            info = zipfile.ZipInfo.from_file(filepath, arcname=f"photos/{filename}")
+            info.compress_type = zipfile.ZIP_STORED
+            with open(filepath, "rb") as src, archive.open(info, "w") as out:
+                while True:
+                    chunk = src.read(EXPORT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+@app.route("/export")
+def export_diary():
+    if not session.get("user"):
+        return redirect("/")
+
+    export_format = request.args.get("format", "zip")
+    stamp = datetime.now().strftime("%Y%m%d")
+    db = get_db()
+
+    if export_format == "jsonl":
+        body = export_jsonl(db, session["user_id"])
+        mimetype = "application/x-ndjson"
+        filename = f"diary-{session['user']}-{stamp}.jsonl"
+    else:
+        body = export_zip(db, session["user_id"])
+        mimetype = "application/zip"
+        filename = f"diary-{session['user']}-{stamp}.zip"
+
+    return Response(stream_with_context(body),
+                    mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={secure_filename(filename)}"})
+
+# ---------------- IMPORT ----------------
+
+IMPORT_FOLDER = os.path.join(os.path.dirname(UPLOAD_FOLDER), 'imports') if os.path.dirname(UPLOAD_FOLDER) else 'imports'
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_COPY_WORKERS = int(os.environ.get('IMPORT_COPY_WORKERS', 4))
+# A running job's worker checks in this often; one silent for IMPORT_STALE_SECONDS is taken as dead
+IMPORT_HEARTBEAT_SECONDS = int(os.environ.get('IMPORT_HEARTBEAT_SECONDS', 15))
+IMPORT_STALE_SECONDS = int(os.environ.get('IMPORT_STALE_SECONDS', 120))
+
+os.makedirs(IMPORT_FOLDER, exist_ok=True)
+
+def open_import_archive(path):
+    """Return (lines, open_photo, close) for a ZIP export or a plain JSONL file"""
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        lines = io.TextIOWrapper(archive.open("entries.jsonl"), encoding="utf-8")
+        members = set(archive.namelist())
+
+        def open_photo(name):
+            member = f"photos/{name}"
+            return archive.open(member) if member in members else None
+
+        def close():
+            lines.close()
+            archive.close()
+
+        return lines, open_photo, close
+
+    lines = open(path, encoding="utf-8")
+    return lines, (lambda name: None), lines.close
+
+def copy_import_photo(open_photo, name):
+    """Copy one photo out of the archive under a fresh upload name; returns a publish_uploads tuple or None"""
+    src = open_photo(name)
+    if src is None:
+        return None
+    filename = new_upload_name(name)
+    with src, open(staging_path(filename), "wb") as dst:
+        shutil.copyfileobj(src, dst, EXPORT_CHUNK_SIZE)
+    return publish_uploads([filename])[0]
+
+def import_batch(db, job, batch, open_photo, pool):
+    """Insert one batch of parsed lines (with their photos) in a single transaction"""
+    # Copy media first, in parallel; the rows only point at files that already exist
+    copies = {}
+    for line_no, entry in batch:
+        for name in entry.get('photos') or []:
+            copies[(line_no, name)] = pool.submit(copy_import_photo, open_photo, name)
+    copied = []
+    try:
+        photo_rows = []
+        for (line_no, name), future in copies.items():
+            result = future.result()
+            if result:
+                copied.append(result[0])
+                photo_rows.append(result + (f"{job['id']}:{line_no}", name))
+
+        entry_rows = [
+            (entry['date'], entry['content'],
+             entry.get('created_at') or datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+             f"{job['id']}:{line_no}")
+            for line_no, entry in batch
+        ]
+
+        # Take the write lock up front instead of upgrading mid-batch, which can fail with SQLITE_BUSY
+        db.execute("BEGIN IMMEDIATE")
+        entries_added = repository.insert_entries_ignoring_duplicates(db, job['user_id'], entry_rows)
+        attached = repository.add_photos_by_source_ref(db, job['user_id'], photo_rows)
+        repository.record_import_progress(db, job['id'], batch[-1][0], entries_added, len(attached))
+        db.execute("COMMIT")
+    except Exception:
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        for future in copies.values():
+            future.cancel()
+        discard_uploads(copied)
+        raise
+    # Copies of photos an earlier run already attached aren't needed
+    discard_uploads(set(copied) - set(attached))
+    return entries_added, len(attached)
+
+def parse_import_line(line):
+    """Validate one JSONL line; returns a dict with at least date and content, or None to skip a bad line"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(entry, dict) or entry.get('content') is None:
+        return None
+    entry['date'] = parse_entry_date(entry.get('date'))
+    if not entry['date']:
+        return None
+    entry['content'] = str(entry['content'])
+    return entry
+
+def run_import(job_id, progress=None):
+    """Run (or resume) an import job; safe to call again after an interruption
+    
+    The job is claimed in the database first, so it never runs twice at once, even from
+    different worker processes; a heartbeat keeps the claim alive while it runs.
+    """
+    db = connect_db(isolation_level=None)
+    stop_heartbeat = threading.Event()
+    try:
+        if not repository.claim_import(db, job_id, IMPORT_STALE_SECONDS):
+            return
+        job = repository.get_import(db, job_id)
+        threading.Thread(target=import_heartbeat, args=(job_id, stop_heartbeat), daemon=True).start()
+
+        lines, open_photo, close = open_import_archive(job['archive_path'])
+        entries_total = job['entries_imported']
+        photos_total = job['photos_imported']
+        try:
+            with ThreadPoolExecutor(max_workers=IMPORT_COPY_WORKERS) as pool:
+                batch = []
+                for line_no, line in enumerate(lines, start=1):
+                    # Lines up to lines_done were committed by an earlier run
+                    if line_no <= job['lines_done']:
+                        continue
+                    entry = parse_import_line(line)
+                    if entry is None:
+                        continue
+                    batch.append((line_no, entry))
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        added, photos = import_batch(db, job, batch, open_photo, pool)
+                        entries_total += added
+                        photos_total += photos
+                        batch = []
+                        if progress:
+                            progress(line_no, entries_total, photos_total)
+                if batch:
+                    added, photos = import_batch(db, job, batch, open_photo, pool)
+                    entries_total += added
+                    photos_total += photos
+                    if progress:
+                        progress(batch[-1][0], entries_total, photos_total)
+        finally:
+            close()
+
+        repository.set_import_status(db, job_id, 'done')
+        try:
+            os.remove(job['archive_path'])
+        except OSError:
+            pass
+    except Exception as e:
+        print(f"Import {job_id} failed: {e}")
+        repository.set_import_status(db, job_id, 'failed', str(e)[:500])
+    finally:
+        stop_heartbeat.set()
+        db.close()
+
+def import_heartbeat(job_id, stop):
+    db = connect_db(isolation_level=None)
+    try:
+        while not stop.wait(IMPORT_HEARTBEAT_SECONDS):
+            try:
+                repository.touch_import(db, job_id)
+            except sqlite3.OperationalError as e:
+                print(f"Import {job_id} heartbeat failed: {e}")
+    finally:
+        db.close()
+
+def start_import(job_id):
+    threading.Thread(target=run_import, args=(job_id,), daemon=True).start()
+
+def create_import_job(db, user_id, archive_path, original_name):
+    job_id = repository.create_import(db, user_id, archive_path, original_name)
+    db.commit()
+    return job_id
+
+@app.route("/import", methods=["GET", "POST"])
+def import_diary():
+    if not session.get("user"):
+        return redirect("/")
+    
+    db = get_db()
+    
+    if request.method == "POST":
+        file = request.files.get("archive")
+        if not file or not file.filename:
+            imports = repository.list_imports(db, session["user_id"], IMPORT_STALE_SECONDS)
+            return render_template_string(IMPORT_PAGE, imports=imports,
+                                        message="Please choose an archive to import")
+        
+        archive_path = os.path.join(IMPORT_FOLDER, f"{uuid.uuid4().hex}.upload")
+        file.save(archive_path)
+        job_id = run_write(repository.create_import, session["user_id"], archive_path, secure_filename(file.filename))
+        start_import(job_id)
+        return redirect("/import")
+    
+    # A 'running' job whose worker stopped checking in was cut off by a restart
+    imports = [dict(job, status='interrupted') if job['stale'] else dict(job)
+               for job in repository.list_imports(db, session["user_id"], IMPORT_STALE_SECONDS)]
+    running = any(job['status'] in ('pending', 'running') for job in imports)
+    return render_template_string(IMPORT_PAGE, imports=imports, running=running)
+
+@app.route("/import/<int:id>/resume", methods=["POST"])
+def resume_import(id):
+    if not session.get("user"):
+        return redirect("/")
+    
+    db = get_db()
+    job = repository.get_import(db, id, session["user_id"])
+    if job and job['status'] != 'done':
+        start_import(job['id'])
+    return redirect("/import")
+
+@app.cli.command("import-diary")
+@click.argument("username")
+@click.argument("archive", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option("--resume", "resume_id", type=int, help="Resume an interrupted import job by id.")
+def import_diary_command(username, archive, resume_id):
+    """Import a ZIP/JSONL ARCHIVE into USERNAME's diary."""
+    db = connect_db()
+    user = repository.get_user_by_username(db, username)
+    if not user:
+        raise click.ClickException(f"No such user: {username}")
+    
+    if resume_id:
+        job_id = resume_id
+    elif archive:
+        # Work on a private copy so the job can be resumed even if the source moves
+        archive_path = os.path.join(IMPORT_FOLDER, f"{uuid.uuid4().hex}.upload")
+        shutil.copyfile(archive, archive_path)
+        job_id = create_import_job(db, user['id'], archive_path, os.path.basename(archive))
+    else:
+        raise click.UsageError("Give an ARCHIVE to import or --resume JOB_ID")
+    db.close()
+    
+    click.echo(f"Import job {job_id}")
+    run_import(job_id, progress=lambda line, entries, photos:
+               click.echo(f"  line {line}: {entries} entries, {photos} photos"))
+    
+    db = connect_db()
+    job = repository.get_import(db, job_id)
+    db.close()
+    if job['status'] != 'done':
+        raise click.ClickException(f"Import {job_id} {job['status']}: {job['error']} (re-run with --resume {job_id})")
+    click.echo(f"Done: {job['entries_imported']} entries, {job['photos_imported']} photos")
+
+# ---------------- JSON API ----------------
+
+API_DEFAULT_LIST_FIELDS = ('id', 'date', 'preview')
+API_ENTRY_FIELDS = ('id', 'date', 'preview', 'word_count', 'char_count', 'content', 'created_at', 'version', 'photos')
+API_MAX_PAGE_SIZE = 200
+
+def api_error(message, status):
+    return jsonify(error=message), status
+
+def parse_api_fields(default):
+    """Sparse field selection from ?fields=a,b,c; returns None if an unknown field was asked for"""
+    raw = request.args.get("fields")
+    if not raw:
+        return default
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    if not fields or any(f not in API_ENTRY_FIELDS for f in fields):
+        return None
+    return fields
+
+def encode_cursor(row):
+    key = json.dumps([row['date'], row['created_at'], row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date, created_at, entry_id = json.loads(base64.urlsafe_b64decode(padded))
+        return (str(date), str(created_at), int(entry_id))
+    except (ValueError, TypeError):
+        return None
+
+def serialize_entry(row, fields, photos=None):
+    item = {}
+    for field in fields:
+        if field == 'photos':
+            item['photos'] = [f"/uploads/{name}" for name in photos or []]
+        else:
+            item[field] = row[field]
+    return item
+
+@app.route("/api/v1/entries")
+def api_entries():
+    if not session.get("user"):
+        return api_error("Not logged in", 401)
+    
+    fields = parse_api_fields(API_DEFAULT_LIST_FIELDS)
+    if fields is None:
+        return api_error(f"fields must be a comma separated subset of: {', '.join(API_ENTRY_FIELDS)}", 400)
+    
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error("limit must be a number", 400)
+    
+    after = None
+    if request.args.get("cursor"):
+        after = decode_cursor(request.args["cursor"])
+        if after is None:
+            return api_error("Invalid cursor", 400)
+    
+    db = get_db()
+    # Fetch one extra row to know whether there is a next page
+    rows = repository.list_entries(db, session["user_id"], fields=fields, after=after, limit=limit + 1,
+                                   date_from=parse_entry_date(request.args.get("from")),
+                                   date_to=parse_entry_date(request.args.get("to")))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    photos = repository.get_photos_for_entries(db, [row['id'] for row in rows]) if 'photos' in fields else {}
+    
+    return jsonify(
+        entries=[serialize_entry(row, fields, photos.get(row['id'])) for row in rows],
+        next_cursor=encode_cursor(rows[-1]) if has_more else None
+    )
+
+@app.route("/api/v1/entries/<int:id>")
+def api_entry(id):
+    if not session.get("user"):
+        return api_error("Not logged in", 401)
+    
+    fields = parse_api_fields(API_ENTRY_FIELDS)
+    if fields is None:
+        return api_error(f"fields must be a comma separated subset of: {', '.join(API_ENTRY_FIELDS)}", 400)
+    
+    db = get_db()
+    entry, photos = repository.get_entry_with_photos(db, session["user_id"], id)
+    if not entry:
+        return api_error("Entry not found", 404)
+    
+    return jsonify(serialize_entry(entry, fields, [p['filename'] for p in photos]))
+
+def apply_text_diff(text, diff):
+    """Apply [[start, end, replacement], ...] splices to `text`; None if the diff doesn't fit it
+    
+    Offsets are code point positions in `text` itself, in ascending order and not overlapping.
+    """
+    if not isinstance(diff, list):
+        return None
+    parts = []
+    pos = 0
+    for op in diff:
+        if not (isinstance(op, list) and len(op) == 3):
+            return None
+        start, end, replacement = op
+        if not (type(start) is int and type(end) is int and isinstance(replacement, str)):
+            return None
+        if not pos <= start <= end <= len(text):
+            return None
+        parts.append(text[pos:start])
+        parts.append(replacement)
+        pos = end
+    parts.append(text[pos:])
+    return "".join(parts)
+
+@app.route("/api/v1/entries/<int:id>", methods=["PATCH"])
+def api_patch_entry(id):
+    """Partial update: {"version": n, "date"?: ..., "content"?: ... | "diff"?: [[start, end, text], ...]}"""
+    if not session.get("user"):
+        return api_error("Not logged in", 401)
+    
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error("Expected a JSON object", 400)
+    version = body.get("version")
+    if type(version) is not int:
+        return api_error("version is required", 400)
+    unknown = set(body) - {"version", "date", "content", "diff"}
+    if unknown:
+        return api_error(f"Unknown fields: {', '.join(sorted(unknown))}", 400)
+    if "content" in body and "diff" in body:
+        return api_error("Send either content or diff, not both", 400)
+    
+    date = None
+    if "date" in body:
+        date = parse_entry_date(body["date"])
+        if not date:
+            return api_error("date must be a valid date", 400)
+    content = body.get("content")
+    if "content" in body and (not isinstance(content, str) or not content):
+        return api_error("content must be a non-empty string", 400)
+    diff = body.get("diff")
+    
+    user_id = session["user_id"]
+    
+    def write(db):
+        entry = repository.get_entry(db, user_id, id)
+        if not entry:
+            return "missing", None
+        if entry['version'] != version:
+            return "conflict", entry
+        
+        new_content = content if content is not None else entry['content']
+        if diff is not None:
+            new_content = apply_text_diff(entry['content'] or "", diff)
+            if not new_content:
+                return "bad_diff", entry
+        new_date = date or entry['date']
+        # Nothing to change (a bare version, or the same values again): leave the version alone so
+        # other clients holding it don't get a spurious conflict
+        if new_date == entry['date'] and new_content == entry['content']:
+            return "ok", entry
+        repository.update_entry(db, user_id, id, new_date, new_content, version=version)
+        return "ok", repository.get_entry(db, user_id, id)
+    
+    status, entry = run_write(write)
+    if status == "missing":
+        return api_error("Entry not found", 404)
+    if status == "conflict":
+        # The current state lets the client rebase its change and retry
+        return jsonify(error="Version mismatch", entry=serialize_entry(entry, ('id', 'version', 'date', 'content'))), 409
+    if status == "bad_diff":
+        return api_error(f"diff does not apply to version {version} (or leaves the entry empty)", 400)
+    return jsonify(serialize_entry(entry, ('id', 'version', 'date', 'preview', 'word_count', 'char_count')))
+
+# ---------------- DRAFTS ----------------
+
+# Stale drafts are also collected from the autosave path, at most this often per process
+DRAFT_GC_INTERVAL_SECONDS = int(os.environ.get('DRAFT_GC_INTERVAL_SECONDS', 3600))
+draft_gc = {'last': time.monotonic()}
+
+def collect_stale_drafts(db):
+    if time.monotonic() - draft_gc['last'] >= DRAFT_GC_INTERVAL_SECONDS:
+        draft_gc['last'] = time.monotonic()
+        repository.delete_stale_drafts(db, DRAFT_MAX_AGE_DAYS)
+
+@app.route("/api/v1/drafts/new", methods=["PATCH", "DELETE"], defaults={"entry_id": 0})
+@app.route("/api/v1/drafts/<int:entry_id>", methods=["PATCH", "DELETE"])
+def api_draft(entry_id):
+    """Autosave: {"date": ..., "base_version"?: n, "content": ...} or {"version": n, "date": ..., "diff": [...]}
+    
+    A diff applies to the draft at `version` (as returned by the previous save); on a mismatch
+    the client gets a 409 and sends the whole content instead.
+    """
+    if not session.get("user"):
+        return api_error("Not logged in", 401)
+    user_id = session["user_id"]
+    
+    if request.method == "DELETE":
+        run_write(repository.delete_draft, user_id, entry_id)
+        return "", 204
+    
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error("Expected a JSON object", 400)
+    if ("content" in body) == ("diff" in body):
+        return api_error("Send either content or diff", 400)
+    content = body.get("content")
+    if "content" in body and not isinstance(content, str):
+        return api_error("content must be a string", 400)
+    diff = body.get("diff")
+    version = body.get("version")
+    if diff is not None and type(version) is not int:
+        return api_error("version is required with diff", 400)
+    base_version = body.get("base_version")
+    if base_version is not None and type(base_version) is not int:
+        return api_error("base_version must be an integer", 400)
+    # Half-typed dates are kept as no date rather than refused
+    date = parse_entry_date(body.get("date"))
+    
+    def write(db):
+        collect_stale_drafts(db)
+        text = content
+        if diff is not None:
+            draft = repository.get_draft(db, user_id, entry_id)
+            if not draft or draft['version'] != version:
+                return "conflict", None
+            text = apply_text_diff(draft['content'], diff)
+            if text is None:
+                return "bad_diff", None
+        return "ok", repository.save_draft(db, user_id, entry_id, date, text, base_version)
+    
+    status, new_version = run_write(write)
+    if status == "conflict":
+        return api_error("Draft version mismatch", 409)
+    if status == "bad_diff":
+        return api_error(f"diff does not apply to draft version {version}", 400)
+    if new_version is None:
+        return api_error("Entry not found", 404)
+    return jsonify(version=new_version)
+
+# ---------------- DELTA SYNC ----------------
+
+SYNC_MAX_PAGE_SIZE = 1000
+
+@app.route("/api/v1/sync")
+def api_sync():
+    """Everything that changed after `cursor`, in change order; pass the returned cursor back next time"""
+    if not session.get("user"):
+        return api_error("Not logged in", 401)
+    
+    try:
+        cursor = max(int(request.args.get("cursor", 0)), 0)
+        limit = min(max(int(request.args.get("limit", 500)), 1), SYNC_MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error("cursor and limit must be numbers", 400)
+    
+    db = get_db()
+    
+    # Deletions older than the floor have been forgotten, so an old cursor can't be trusted
+    if cursor and cursor < repository.get_tombstone_floor(db):
+        return jsonify(reset=True, cursor=0, has_more=True, entries=[], photos=[],
+                       deleted={'entries': [], 'photos': []})
+    
+    changes = repository.get_changes_since(db, session["user_id"], cursor, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    
+    entry_ids = [c['object_id'] for c in changes if c['kind'] == 'entry' and not c['deleted']]
+    photo_ids = [c['object_id'] for c in changes if c['kind'] == 'photo' and not c['deleted']]
+    
+    # Each entry carries its version, which /update and the draft base_version expect back
+    entries = [dict(row) for row in repository.get_entries_by_ids(db, session["user_id"], entry_ids)]
+    photos = [{'id': row['id'], 'entry_id': row['entry_id'], 'url': f"/uploads/{row['filename']}"}
+              for row in repository.get_photos_by_ids(db, session["user_id"], photo_ids)]
+    
+    return jsonify(
+        reset=False,
+        cursor=changes[-1]['seq'] if changes else cursor,
+        has_more=has_more,
+        entries=entries,
+        photos=photos,
+        deleted={
+            'entries': [c['object_id'] for c in changes if c['kind'] == 'entry' and c['deleted']],
+            'photos': [c['object_id'] for c in changes if c['kind'] == 'photo' and c['deleted']],
+        }
+    )
+
+# ---------------- CONTENT COMPRESSION ----------------
+
+@app.cli.command("recompress-entries")
+@click.option("--threshold", type=int, default=None,
+              help="Compress bodies larger than this many bytes (default: CONTENT_COMPRESS_THRESHOLD).")
+@click.option("--batch-size", type=int, default=500, show_default=True)
+@click.option("--dry-run", is_flag=True, help="Only report what would change.")
+def recompress_entries_command(threshold, batch_size, dry_run):
+    """Re-encode stored entry bodies under the current compression threshold and report the savings."""
+    db = connect_db()
+    
+    stored_before = stored_after = 0
+    plain_bytes = 0
+    rewritten = compressed = 0
+    last_id = 0
+    
+    try:
+        while True:
+            rows = repository.get_stored_content_batch(db, last_id, batch_size)
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            
+            updates = []
+            for row in rows:
+                stored = row['content']
+                if stored is None:
+                    continue
+                
+                content = repository.decode_content(stored)
+                new_stored = repository.encode_content(content, threshold)
+                old_size = len(stored) if isinstance(stored, bytes) else len(stored.encode('utf-8'))
+                new_size = len(new_stored) if isinstance(new_stored, bytes) else len(new_stored.encode('utf-8'))
+                plain_bytes += len(content.encode('utf-8'))
+                stored_before += old_size
+                stored_after += new_size
+                if isinstance(new_stored, bytes):
+                    compressed += 1
+                if new_stored != stored:
+                    updates.append((new_stored, row['id']))
+            
+            rewritten += len(updates)
+            if updates and not dry_run:
+                repository.set_stored_content(db, updates)
+                db.commit()
+    finally:
+        db.close()
+    
+    # What reading a compressed body costs from now on, measured over a sample
+    sample_cost = 0.0
+    if compressed:
+        db = connect_db()
+        try:
+            sample = repository.get_compressed_content_sample(db, 1000)
+        finally:
+            db.close()
+        started = time.perf_counter()
+        for stored in sample:
+            repository.decode_content(stored)
+        sample_cost = (time.perf_counter() - started) / len(sample) if sample else 0.0
+    
+    mb = 1024 * 1024
+    click.echo(f"{'Would rewrite' if dry_run else 'Rewrote'} {rewritten} entries")
+    click.echo(f"Compressed entries:  {compressed}")
+    click.echo(f"Plain text size:     {plain_bytes / mb:.2f} MB")
+    click.echo(f"Stored size before:  {stored_before / mb:.2f} MB")
+    click.echo(f"Stored size after:   {stored_after / mb:.2f} MB "
+               f"({(1 - stored_after / stored_before) * 100 if stored_before else 0:.1f}% saved)")
+    click.echo(f"Decode cost:         {sample_cost * 1e6:.1f} us per compressed entry")
+    if not dry_run and rewritten:
+        click.echo("Run VACUUM during a quiet period to return the freed pages to the filesystem.")
+
+# ---------------- PHOTO PREVIEWS ----------------
+
+@app.cli.command("backfill-photo-previews")
+@click.option("--batch-size", type=int, default=200, show_default=True)
+def backfill_photo_previews_command(batch_size):
+    """Compute dimensions and placeholders for photos uploaded before they were recorded at ingest."""
+    if Image is None:
+        raise click.ClickException("Pillow is not installed")
+    
+    db = connect_db()
+    done = skipped = 0
+    last_id = 0
+    try:
+        while True:
+            rows = repository.get_unpreviewed_photos(db, last_id, batch_size)
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            previews = []
+            for row in rows:
+                preview = photo_preview(os.path.join(UPLOAD_FOLDER, row['filename']))
+                skipped += preview[2] is None
+                previews.append(preview + (row['id'],))
+            repository.set_photo_previews(db, previews)
+            db.commit()
+            done += len(rows)
+    finally:
+        db.close()
+    
+    click.echo(f"Processed {done} photos ({skipped} missing or not decodable)")
+
+# ---------------- WRITE STRESS ----------------
+
+def stress_worker(rate, seconds, threads, user_id):
+    """One simulated app process: `threads` request threads writing at `rate` per second in total"""
+    latencies = []
+    errors = {'locked': 0, 'other': 0}
+    record_lock = threading.Lock()
+    deadline = time.time() + seconds
+    
+    def request_thread():
+        interval = threads / rate
+        next_at = time.time()
+        while next_at < deadline:
+            time.sleep(max(0, next_at - time.time()))
+            next_at += interval
+            started = time.perf_counter()
+            try:
+                run_write(repository.insert_entry, user_id, "2000-01-01", "stress " * 20)
+                with record_lock:
+                    latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                with record_lock:
+                    errors['locked' if is_busy_error(e) else 'other'] += 1
+    
+    pool = [threading.Thread(target=request_thread) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies, errors
+
+@app.cli.command("stress-writes")
+@click.option("--processes", type=int, default=4, show_default=True, help="Simulated worker processes.")
+@click.option("--threads", type=int, default=8, show_default=True, help="Request threads per process.")
+@click.option("--rate", type=int, default=200, show_default=True, help="Target writes per second across all processes.")
+@click.option("--seconds", type=int, default=10, show_default=True)
+def stress_writes_command(processes, threads, rate, seconds):
+    """Hammer the database with concurrent entry writes and report lock errors and latency."""
+    import multiprocessing
+    
+    db = connect_db()
+    username = f"stress-{uuid.uuid4().hex[:8]}"
+    user_id = repository.create_user(db, username, "!", None)
+    db.commit()
+    db.close()
+    
+    click.echo(f"{processes} processes x {threads} threads, {rate} writes/s for {seconds}s as {username}")
+    started = time.time()
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+        results = pool.starmap(stress_worker, [(rate / processes, seconds, threads, user_id)] * processes)
+    elapsed = time.time() - started
+    
+    latencies = sorted(l for worker_latencies, _ in results for l in worker_latencies)
+    locked = sum(errors['locked'] for _, errors in results)
+    other = sum(errors['other'] for _, errors in results)
+    
+    db = connect_db()
+    try:
+        purge_account(db, user_id)
+    finally:
+        db.close()
+    
+    click.echo(f"Writes committed:  {len(latencies)} ({len(latencies) / elapsed:.0f}/s)")
+    if latencies:
+        click.echo(f"Latency p50/p99:   {latencies[len(latencies) // 2] * 1000:.1f} / "
+                   f"{latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    click.echo(f"Lock errors:       {locked}")
+    click.echo(f"Other errors:      {other}")
+    if locked or other:
+        raise SystemExit(1)
+
+# ---------------- EXPORT BENCHMARK ----------------
+
+def bench_export_worker(user_id, username, export_format, result):
+    """Stream one export through the app in a fresh process; reports RSS, time to first byte and throughput"""
+    import resource
+    
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = username
+        sess['user_id'] = user_id
+    
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    first_byte = None
+    total = 0
+    response = client.get(f"/export?format={export_format}", buffered=False)
+    for chunk in response.response:
+        if chunk and first_byte is None:
+            first_byte = time.perf_counter() - started
+        total += len(chunk)
+    response.close()
+    result.update(
+        baseline_kb=baseline,
+        peak_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        first_byte=first_byte,
+        seconds=time.perf_counter() - started,
+        bytes=total,
+    )
+
+@app.cli.command("bench-export")
+@click.option("--entries", type=int, default=10000, show_default=True)
+@click.option("--photos", type=int, default=2000, show_default=True, help="Photos, spread over the entries.")
+@click.option("--photo-mb", type=float, default=1.5, show_default=True, help="Size of each photo file.")
+@click.option("--format", "formats", multiple=True, default=("zip", "jsonl"), show_default=True)
+def bench_export_command(entries, photos, photo_mb, formats):
+    """Seed a throwaway user with ENTRIES entries and PHOTOS photo files, then time streaming exports of it."""
+    import multiprocessing
+    
+    db = connect_db()
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    user_id = repository.create_user(db, username, "!", None)
+    db.commit()
+    
+    click.echo(f"Seeding {entries} entries and {photos} photos of {photo_mb} MB as {username}...")
+    # Photo content doesn't matter to the export (it's stored, not deflated), so one random block is reused
+    block = os.urandom(1024 * 1024)
+    photo_bytes = int(photo_mb * 1024 * 1024)
+    text = "A day like any other, written down so it isn't forgotten. " * 20
+    entry_ids = []
+    for start in range(0, entries, 1000):
+        for i in range(start, min(start + 1000, entries)):
+            entry_ids.append(repository.insert_entry(db, user_id, f"{2000 + i // 365:04d}-01-01", f"{i}: {text}"))
+        db.commit()
+    for i in range(photos):
+        filename = f"{uuid.uuid4().hex}.jpg"
+        with open(os.path.join(UPLOAD_FOLDER, filename), "wb") as f:
+            for offset in range(0, photo_bytes, len(block)):
+                f.write(block[:photo_bytes - offset])
+        repository.add_photos(db, user_id, entry_ids[i * len(entry_ids) // photos], [(filename, photo_bytes, None, None, None)])
+        if i % 100 == 99:
+            db.commit()
+    db.commit()
+    db.close()
+    
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Manager() as manager:
+            for export_format in formats:
+                result = manager.dict()
+                worker = ctx.Process(target=bench_export_worker, args=(user_id, username, export_format, result))
+                worker.start()
+                worker.join()
+                if worker.exitcode:
+                    raise click.ClickException(f"{export_format} export failed")
+                mb = result['bytes'] / 1024 / 1024
+                click.echo(f"{export_format:5}  {mb:9.1f} MB in {result['seconds']:.1f}s ({mb / result['seconds']:.0f} MB/s), "
+                           f"first byte after {result['first_byte'] * 1000:.0f} ms, "
+                           f"peak RSS {result['peak_kb'] / 1024:.0f} MB (+{(result['peak_kb'] - result['baseline_kb']) / 1024:.1f} MB while exporting)")
+    finally:
+        db = connect_db()
+        try:
+            purge_account(db, user_id)
+        finally:
+            db.close()
+
+# ---------------- BACKUPS ----------------
+
+# Each snapshot is BACKUP_DIR/<timestamp>/ with a consistent copy of the database and a manifest of
+# the upload files it needs; uploads are never modified, so each file is copied into BACKUP_DIR/uploads once
+BACKUP_DIR = os.environ.get('BACKUP_DIR') or os.path.join(os.path.dirname(DATABASE) or '.', 'backups')
+BACKUP_INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', 0))  # 0 disables the in-app scheduler
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+BACKUP_STEP_PAUSE_SECONDS = float(os.environ.get('BACKUP_STEP_PAUSE_SECONDS', 0.01))
+
+backup_lock = threading.Lock()
+
+class BackupInProgress(Exception):
+    pass
+
+def list_backups():
+    """Names of complete snapshots, oldest first"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(name for name in os.listdir(BACKUP_DIR)
+                  if os.path.isfile(os.path.join(BACKUP_DIR, name, "manifest.json")))
+
+def read_backup_manifest(name):
+    with open(os.path.join(BACKUP_DIR, name, "manifest.json")) as f:
+        return json.load(f)
+
+def list_upload_files():
+    """{relative path: size} for every stored upload, including kept originals"""
+    files = {}
+    for folder, prefix in ((UPLOAD_FOLDER, ""), (ORIGINALS_FOLDER, "originals/")):
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as it:
+            for item in it:
+                if item.is_file() and not item.name.startswith(STAGING_PREFIX):
+                    files[prefix + item.name] = item.stat().st_size
+    return files
+
+def copy_database_online(dest_path):
+    """Copy the live database a few pages at a time, so writers only ever wait for one small step"""
+    src = connect_db()
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP,
+                   progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_PAUSE_SECONDS))
+        if dst.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            raise RuntimeError("backup copy failed its integrity check")
+        return dst.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+def create_backup():
+    """Take one snapshot; returns its manifest. Raises BackupInProgress if another process is taking one."""
+    os.makedirs(os.path.join(BACKUP_DIR, "uploads", "originals"), exist_ok=True)
+    with backup_lock, open(os.path.join(BACKUP_DIR, ".lock"), "w") as lock_file:
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise BackupInProgress()
+        
+        name = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        partial = os.path.join(BACKUP_DIR, name + ".partial")
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+        started = time.time()
+        
+        try:
+            schema_version = copy_database_online(os.path.join(partial, "diary.db"))
+            
+            # Upload files referenced by the copied rows already existed when it was taken
+            uploads = list_upload_files()
+            added = []
+            for relpath in uploads:
+                target = os.path.join(BACKUP_DIR, "uploads", relpath)
+                if not os.path.exists(target):
+                    shutil.copyfile(os.path.join(UPLOAD_FOLDER, relpath), target + ".part")
+                    os.replace(target + ".part", target)
+                    added.append(relpath)
+            
+            manifest = {
+                'name': name,
+                'created_at': datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+                'schema_version': schema_version,
+                'database_bytes': os.path.getsize(os.path.join(partial, "diary.db")),
+                'uploads': uploads,
+                'added': added,
+                'seconds': round(time.time() - started, 2),
+            }
+            with open(os.path.join(partial, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            # The snapshot only shows up under its final name once it is complete
+            os.replace(partial, os.path.join(BACKUP_DIR, name))
+        except Exception:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        
+        prune_backups(BACKUP_KEEP)
+        return manifest
+
+def prune_backups(keep):
+    """Delete all but the newest `keep` snapshots, then any stored upload none of the survivors lists"""
+    names = list_backups()
+    for name in names[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(BACKUP_DIR, name), ignore_errors=True)
+    
+    needed = set()
+    for name in list_backups():
+        needed.update(read_backup_manifest(name)['uploads'])
+    for folder, prefix in ((os.path.join(BACKUP_DIR, "uploads"), ""),
+                           (os.path.join(BACKUP_DIR, "uploads", "originals"), "originals/")):
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as it:
+            for item in it:
+                if item.is_file() and prefix + item.name not in needed:
+                    os.remove(item.path)
+
+def restore_backup(name):
+    """Copy a snapshot's database over the live one and bring back any upload files that are missing"""
+    manifest = read_backup_manifest(name)
+    src = sqlite3.connect(os.path.join(BACKUP_DIR, name, "diary.db"))
+    dst = sqlite3.connect(DATABASE, timeout=SQLITE_BUSY_TIMEOUT)
+    try:
+        # The backup API writes through SQLite, so an existing WAL file can't resurrect old pages
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    
+    restored = 0
+    os.makedirs(ORIGINALS_FOLDER, exist_ok=True)
+    for relpath in manifest['uploads']:
+        target = os.path.join(UPLOAD_FOLDER, relpath)
+        if not os.path.exists(target):
+            shutil.copyfile(os.path.join(BACKUP_DIR, "uploads", relpath), target)
+            restored += 1
+    return manifest, restored
+
+def run_backup_scheduler():
+    while True:
+        time.sleep(60)
+        try:
+            names = list_backups()
+            last = datetime.strptime(names[-1], "%Y%m%dT%H%M%SZ") if names else None
+            if last is None or datetime.utcnow() - last >= timedelta(hours=BACKUP_INTERVAL_HOURS):
+                manifest = create_backup()
+                print(f"Backup {manifest['name']} done in {manifest['seconds']}s "
+                      f"({len(manifest['added'])} new upload files)")
+        except BackupInProgress:
+            pass
+        except Exception as e:
+            print(f"Backup failed: {e}")
+
+@app.cli.command("backup")
+def backup_command():
+    """Take an online snapshot of the database and uploads into BACKUP_DIR."""
+    try:
+        manifest = create_backup()
+    except BackupInProgress:
+        raise click.ClickException("Another backup is already running")
+    click.echo(f"Backup {manifest['name']}: database {manifest['database_bytes'] / 1048576:.2f} MB, "
+               f"{len(manifest['uploads'])} upload files ({len(manifest['added'])} new), "
+               f"{manifest['seconds']}s")
+
+@app.cli.command("list-backups")
+def list_backups_command():
+    """Show the snapshots in BACKUP_DIR."""
+    for name in list_backups():
+        manifest = read_backup_manifest(name)
+        click.echo(f"{name}  schema v{manifest['schema_version']}  "
+                   f"{manifest['database_bytes'] / 1048576:.2f} MB  {len(manifest['uploads'])} files")
+
+@app.cli.command("restore-backup")
+@click.argument("name")
+@click.option("--yes", is_flag=True, help="Don't ask for confirmation.")
+def restore_backup_command(name, yes):
+    """Replace the database with snapshot NAME and restore missing uploads (stop the app first)."""
+    if name not in list_backups():
+        raise click.ClickException(f"No complete backup named {name}")
+    if not yes:
+        click.confirm(f"Overwrite {DATABASE} with backup {name}?", abort=True)
+    manifest, restored = restore_backup(name)
+    click.echo(f"Restored database (schema v{manifest['schema_version']}) and {restored} upload files")
+
+@app.cli.command("prune-backups")
+@click.option("--keep", type=int, default=BACKUP_KEEP, show_default=True)
+def prune_backups_command(keep):
+    """Apply the retention policy to BACKUP_DIR."""
+    prune_backups(keep)
+    click.echo(f"{len(list_backups())} backups kept")
+
+if BACKUP_INTERVAL_HOURS > 0:
+    threading.Thread(target=run_backup_scheduler, daemon=True).start()
+
+# ---------------- HEALTH CHECKS ----------------
+
+# Probes hit these every few seconds, so the readiness result is reused for a short while
+HEALTH_CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', 5))
+MIN_FREE_DISK_MB = int(os.environ.get('MIN_FREE_DISK_MB', 100))
+MAX_WRITE_QUEUE_DEPTH = int(os.environ.get('MAX_WRITE_QUEUE_DEPTH', 100))
+
+readiness = {'result': None, 'checked_at': 0.0}
+readiness_lock = threading.Lock()
+
+def check_readiness():
+    """(ready, {check: "ok" or what is wrong})"""
+    checks = {}
+    try:
+        db = connect_db()
+        try:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            db.close()
+        checks['database'] = "ok"
+        checks['schema'] = "ok" if version == SCHEMA_VERSION else f"at version {version}, expected {SCHEMA_VERSION}"
+    except sqlite3.Error as e:
+        checks['database'] = f"unavailable: {e}"
+    
+    free_mb = shutil.disk_usage(UPLOAD_FOLDER).free // (1024 * 1024)
+    checks['disk'] = "ok" if free_mb >= MIN_FREE_DISK_MB else f"only {free_mb} MB free"
+    
+    depth = writer.depth()
+    checks['write_queue'] = "ok" if depth <= MAX_WRITE_QUEUE_DEPTH else f"{depth} writes queued"
+    
+    return all(status == "ok" for status in checks.values()), checks
+
+@app.route("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return Response("ok", mimetype="text/plain")
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: the database is reachable and migrated, the volume has room and writes are keeping up"""
+    with readiness_lock:
+        if readiness['result'] is None or time.time() - readiness['checked_at'] > HEALTH_CACHE_SECONDS:
+            readiness['result'] = check_readiness()
+            readiness['checked_at'] = time.time()
+        ready, checks = readiness['result']
+    
+    return jsonify(status="ready" if ready else "not ready", checks=checks), 200 if ready else 503
+
 # ---------------- RUN APP ----------------
 
 if __name__ == "__main__":
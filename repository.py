@@ -0,0 +1,627 @@
+# Data access for the diary app - every query against users, entries and photos lives here.
+# Functions take an open sqlite3 connection (with sqlite3.Row as row factory) and never commit;
+# the caller owns the transaction.
+
+import difflib
+import json
+import os
+import re
+import zlib
+
+# ---------------- USERS ----------------
+
+# Each sort is served by an index on the users table (the counters are kept current by triggers);
+# every index also carries the id, which breaks ties so the pages can be keyed on (sort key, id)
+USER_SORT_COLUMNS = {
+    'name': 'username COLLATE NOCASE',
+    'joined': 'created_at',
+    'entries': 'entry_count',
+    'storage': 'storage_bytes',
+}
+# Names read A to Z; the other sorts put the newest and largest first
+USER_SORT_ASCENDING = {'name'}
+
+def get_user_by_id(db, user_id):
+    return db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+
+def get_user_by_username(db, username):
+    return db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+
+def get_user_by_email(db, email):
+    return db.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+
+def create_user(db, username, password_hash, email):
+    """Raises sqlite3.IntegrityError if the username or email is taken"""
+    return db.execute(
+        "INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
+        (username, password_hash, email)
+    ).lastrowid
+
+def update_password(db, user_id, password_hash):
+    db.execute("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id))
+
+def delete_user(db, user_id):
+    """Delete a non-admin user; whatever entries and photos remain go with it through ON DELETE CASCADE"""
+    db.execute("DELETE FROM users WHERE id = ? AND username != 'admin'", (user_id,))
+
+def soft_delete_user(db, user_id):
+    """Mark a non-admin user as deleted so the purge worker removes their data; returns False if nothing changed"""
+    return db.execute(
+        "UPDATE users SET deleted_at = CURRENT_TIMESTAMP WHERE id = ? AND username != 'admin' AND deleted_at IS NULL",
+        (user_id,)
+    ).rowcount > 0
+
+def get_deleted_user_ids(db):
+    return [row[0] for row in db.execute("SELECT id FROM users WHERE deleted_at IS NOT NULL ORDER BY id")]
+
+def like_prefix(text):
+    """LIKE pattern matching values that start with `text` (case-insensitive, wildcards escaped)"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def search_users(db, search, sort, page_size, after=None, before=None):
+    """One page of the admin user directory, in `sort` order; returns (users, has_more)
+
+    `after` / `before` is the (sort_key, id) of the last / first row of the page already shown.
+    `has_more` says whether there are rows beyond the page in the direction being paged.
+    """
+    key = USER_SORT_COLUMNS[sort]
+    sql = f"""
+        SELECT id, username, email, created_at, entry_count, photo_count, storage_bytes, deleted_at,
+               {key} AS sort_key
+        FROM users
+        WHERE username != 'admin'
+    """
+    params = []
+    if search:
+        # Prefix matches can use the NOCASE indexes on username and email
+        sql += " AND (username LIKE ? ESCAPE '\\' OR email LIKE ? ESCAPE '\\')"
+        params.extend([like_prefix(search), like_prefix(search)])
+    # Paging backwards walks the index the other way and flips the page round afterwards
+    forward = (sort in USER_SORT_ASCENDING) == (before is None)
+    cursor = before or after
+    if cursor:
+        # The bare bound on the sort key is what lets SQLite seek into the index rather than scan it
+        op = '>' if forward else '<'
+        sql += f" AND {key} {op}= ? AND ({key}, id) {op} (?, ?)"
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    direction = 'ASC' if forward else 'DESC'
+    sql += f" ORDER BY {key} {direction}, id {direction} LIMIT ?"
+    params.append(page_size + 1)
+    users = db.execute(sql, params).fetchall()
+    has_more = len(users) > page_size
+    users = users[:page_size]
+    return (users[::-1] if before else users), has_more
+
+def get_user_totals(db):
+    """Site-wide totals; the per-user counters make this one pass over users instead of COUNTs over entries and photos"""
+    totals = db.execute("""
+        SELECT COUNT(*) as all_users,
+               COALESCE(SUM(username != 'admin' AND deleted_at IS NULL), 0) as total_users,
+               COALESCE(SUM(entry_count), 0) as total_entries,
+               COALESCE(SUM(photo_count), 0) as total_photos
+        FROM users
+    """).fetchone()
+    new_users_today = db.execute("""
+        SELECT COUNT(*) as count FROM users
+        WHERE created_at >= date('now') AND username != 'admin'
+    """).fetchone()['count']
+    return dict(totals, new_users_today=new_users_today)
+
+def get_entries_generation(db, user_id):
+    row = db.execute("SELECT entries_generation FROM users WHERE id = ?", (user_id,)).fetchone()
+    return row['entries_generation'] if row else None
+
+def bump_entries_generation(db, user_id):
+    """Invalidate a user's cached entries list in every worker"""
+    db.execute("UPDATE users SET entries_generation = entries_generation + 1 WHERE id = ?", (user_id,))
+
+# ---------------- ENTRY CONTENT ENCODING ----------------
+
+# Bodies longer than this (in UTF-8 bytes) are stored zlib-compressed as a BLOB behind CONTENT_MARKER;
+# anything else stays plain TEXT, so old rows and short entries need no decoding at all
+CONTENT_COMPRESS_THRESHOLD = int(os.environ.get('CONTENT_COMPRESS_THRESHOLD', 2048))
+CONTENT_MARKER = b'\x00zlib1:'
+
+def encode_content(content, threshold=None):
+    """The value to store for an entry body"""
+    if content is None:
+        return None
+    threshold = CONTENT_COMPRESS_THRESHOLD if threshold is None else threshold
+    raw = content.encode('utf-8')
+    if len(raw) <= threshold:
+        return content
+    compressed = CONTENT_MARKER + zlib.compress(raw, 6)
+    # Not worth it if it barely shrinks (e.g. pasted base64)
+    if len(compressed) >= len(raw) * 0.9:
+        return content
+    return compressed
+
+def decode_content(value):
+    """The entry body for a stored value, whichever format it was written in"""
+    if isinstance(value, bytes):
+        if value.startswith(CONTENT_MARKER):
+            return zlib.decompress(value[len(CONTENT_MARKER):]).decode('utf-8')
+        return value.decode('utf-8')
+    return value
+
+def decoded(row):
+    """A row as a dict with its content decoded"""
+    item = dict(row)
+    if 'content' in item:
+        item['content'] = decode_content(item['content'])
+    return item
+
+# ---------------- ENTRIES ----------------
+
+PREVIEW_LENGTH = 40
+
+# Columns the entry queries can select, keyed by the field name they produce
+ENTRY_COLUMNS = {
+    'id': 'id',
+    'date': 'date',
+    'preview': 'preview',
+    'word_count': 'word_count',
+    'char_count': 'char_count',
+    'content': 'content',
+    'created_at': 'created_at',
+    'version': 'version',
+}
+
+def entry_stats(content):
+    """(preview, word_count, char_count) stored alongside an entry's content"""
+    content = content or ''
+    return content[:PREVIEW_LENGTH], len(content.split()), len(content)
+
+def list_entries(db, user_id, fields=('id', 'date', 'preview', 'word_count'), after=None, limit=None,
+                 date_from=None, date_to=None):
+    """A user's entries, newest first; `after` is the (date, created_at, id) of the last row already seen
+
+    Without 'content' in `fields` this is answered from idx_entries_list alone, date range included.
+    """
+    # The sort key is always selected so callers can build a keyset cursor from the last row
+    columns = [ENTRY_COLUMNS[f] for f in fields if f in ENTRY_COLUMNS and f not in ('id', 'date', 'created_at')]
+    sql = f"SELECT {', '.join(['id', 'date', 'created_at'] + columns)} FROM entries WHERE user_id = ?"
+    params = [user_id]
+    if date_from:
+        sql += " AND date >= ?"
+        params.append(date_from)
+    if date_to:
+        sql += " AND date <= ?"
+        params.append(date_to)
+    if after:
+        sql += " AND (date, created_at, id) < (?, ?, ?)"
+        params.extend(after)
+    sql += " ORDER BY date DESC, created_at DESC, id DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    rows = db.execute(sql, params).fetchall()
+    return [decoded(row) for row in rows] if 'content' in fields else rows
+
+def count_entries_by_day(db, user_id, date_from, date_to):
+    """{date: entry count} for days in [date_from, date_to] that have entries"""
+    return dict(db.execute("""
+        SELECT date, COUNT(*) FROM entries
+        WHERE user_id = ? AND date >= ? AND date <= ?
+        GROUP BY date
+    """, (user_id, date_from, date_to)).fetchall())
+
+def count_entries_by_month(db, user_id, year):
+    """{'YYYY-MM': entry count} for months of `year` that have entries"""
+    return dict(db.execute("""
+        SELECT substr(date, 1, 7) as month, COUNT(*) FROM entries
+        WHERE user_id = ? AND date >= ? AND date < ?
+        GROUP BY month
+    """, (user_id, f"{year:04d}-01-01", f"{year + 1:04d}-01-01")).fetchall())
+
+def get_entry(db, user_id, entry_id):
+    row = db.execute(
+        "SELECT * FROM entries WHERE id = ? AND user_id = ?",
+        (entry_id, user_id)
+    ).fetchone()
+    return decoded(row) if row else None
+
+def get_entry_with_photos(db, user_id, entry_id):
+    """An entry and its photos in one round trip; returns (entry, photos) or (None, [])"""
+    row = db.execute("""
+        SELECT e.*,
+               (SELECT json_group_array(json_object('id', p.id, 'filename', p.filename, 'size_bytes', p.size_bytes,
+                                                    'width', p.width, 'height', p.height, 'placeholder', p.placeholder))
+                FROM (SELECT * FROM photos WHERE entry_id = e.id ORDER BY id) p) as photos_json
+        FROM entries e
+        WHERE e.id = ? AND e.user_id = ?
+    """, (entry_id, user_id)).fetchone()
+    if not row:
+        return None, []
+    entry = decoded(row)
+    photos = json.loads(entry.pop('photos_json'))
+    return entry, photos
+
+def get_entries_by_ids(db, user_id, entry_ids, columns="id, date, content, created_at, version"):
+    """Batch-load a user's entries by id (order not guaranteed)"""
+    if not entry_ids:
+        return []
+    placeholders = ", ".join("?" * len(entry_ids))
+    return [decoded(row) for row in db.execute(
+        f"SELECT {columns} FROM entries WHERE user_id = ? AND id IN ({placeholders})",
+        [user_id] + list(entry_ids)
+    )]
+
+def iter_entries_for_export(db, user_id):
+    """Every entry of a user with its photo filenames, oldest first, streamed from a cursor"""
+    cursor = db.execute("""
+        SELECT e.id, e.date, e.content, e.created_at,
+               (SELECT group_concat(p.filename, '/') FROM photos p WHERE p.entry_id = e.id) as photos
+        FROM entries e
+        WHERE e.user_id = ?
+        ORDER BY e.id
+    """, (user_id,))
+    for row in cursor:
+        yield {
+            'id': row['id'],
+            'date': row['date'],
+            'content': decode_content(row['content']),
+            'created_at': row['created_at'],
+            'photos': row['photos'].split('/') if row['photos'] else []
+        }
+
+def insert_entry(db, user_id, date, content):
+    entry_id = db.execute(
+        "INSERT INTO entries (user_id, date, content, preview, word_count, char_count) VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, date, encode_content(content)) + entry_stats(content)
+    ).lastrowid
+    bump_entries_generation(db, user_id)
+    return entry_id
+
+def insert_entries_ignoring_duplicates(db, user_id, rows):
+    """Bulk insert (date, content, created_at, source_ref) rows; rows whose source_ref exists are skipped"""
+    cursor = db.executemany(
+        """INSERT OR IGNORE INTO entries (user_id, date, content, created_at, source_ref, preview, word_count, char_count)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        [(user_id, date, encode_content(content), created_at, source_ref) + entry_stats(content)
+         for date, content, created_at, source_ref in rows]
+    )
+    if cursor.rowcount:
+        bump_entries_generation(db, user_id)
+    return cursor.rowcount
+
+def update_entry(db, user_id, entry_id, date, content, version=None):
+    """Ownership-checked update that bumps the entry's version and keeps the replaced text as a revision
+    
+    With `version`, the update only applies if the entry is still at that version.
+    Returns the new version, or None if the entry isn't the user's (or has moved on).
+    Callers run this in a write transaction, so nothing can change between the read and the update.
+    """
+    old = db.execute(
+        "SELECT date, content, version FROM entries WHERE id = ? AND user_id = ?",
+        (entry_id, user_id)
+    ).fetchone()
+    if not old or (version is not None and old[2] != version):
+        return None
+    old_date, old_content, old_version = old[0], decode_content(old[1]), old[2]
+    
+    db.execute(
+        """UPDATE entries SET date = ?, content = ?, preview = ?, word_count = ?, char_count = ?, version = ?
+           WHERE id = ?""",
+        (date, encode_content(content)) + entry_stats(content) + (old_version + 1, entry_id)
+    )
+    if (old_date, old_content) != (date, content):
+        add_revision(db, entry_id, old_version, old_date, old_content or '', content or '')
+    bump_entries_generation(db, user_id)
+    return old_version + 1
+
+def delete_entry(db, user_id, entry_id):
+    """Ownership-checked delete; photos go with it through ON DELETE CASCADE"""
+    cursor = db.execute(
+        "DELETE FROM entries WHERE id = ? AND user_id = ?",
+        (entry_id, user_id)
+    )
+    if cursor.rowcount:
+        bump_entries_generation(db, user_id)
+    return cursor.rowcount > 0
+
+def delete_user_entries_batch(db, user_id, limit):
+    """Delete up to `limit` of a user's entries (and any photos still attached); returns how many went"""
+    return db.execute(
+        "DELETE FROM entries WHERE id IN (SELECT id FROM entries WHERE user_id = ? LIMIT ?)",
+        (user_id, limit)
+    ).rowcount
+
+def get_unstatted_entries(db, limit):
+    """(id, content) of entries missing their list columns, content decoded"""
+    rows = db.execute("SELECT id, content FROM entries WHERE word_count IS NULL LIMIT ?", (limit,)).fetchall()
+    return [(row[0], decode_content(row[1])) for row in rows]
+
+def get_stored_content_batch(db, after_id, limit):
+    """(id, stored content) for entries after `after_id`, in id order, for offline maintenance"""
+    return db.execute(
+        "SELECT id, content FROM entries WHERE id > ? ORDER BY id LIMIT ?",
+        (after_id, limit)
+    ).fetchall()
+
+def get_compressed_content_sample(db, limit):
+    """Stored values of up to `limit` compressed entry bodies, undecoded"""
+    return [row[0] for row in db.execute(
+        "SELECT content FROM entries WHERE typeof(content) = 'blob' LIMIT ?",
+        (limit,)
+    )]
+
+def set_stored_content(db, rows):
+    """Rewrite (stored content, entry_id) rows without touching anything else"""
+    db.executemany("UPDATE entries SET content = ? WHERE id = ?", rows)
+
+def set_entry_stats(db, rows):
+    """Record (preview, word_count, char_count, entry_id) rows"""
+    db.executemany("UPDATE entries SET preview = ?, word_count = ?, char_count = ? WHERE id = ?", rows)
+
+# ---------------- REVISIONS ----------------
+
+# Each edit keeps the text it replaced as a revision: a zlib-compressed delta that rebuilds it from the
+# next version's text, or (once REVISION_SNAPSHOT_EVERY - 1 deltas are stacked on top) the whole text,
+# so rebuilding any version applies at most that many deltas. REVISION_KEEP bounds an entry's history (0: no bound).
+REVISION_SNAPSHOT_EVERY = int(os.environ.get('REVISION_SNAPSHOT_EVERY', 10))
+REVISION_KEEP = int(os.environ.get('REVISION_KEEP', 50))
+
+DIFF_TOKENS = re.compile(r'\w+|\s+|[^\w\s]+')
+
+def text_delta(new, old):
+    """Ops that rebuild `old` from `new`: [start, end] copies new[start:end], a string is inserted as is"""
+    # Edits are usually local, so only the middle between the common prefix and suffix is diffed
+    prefix = len(os.path.commonprefix([new, old]))
+    suffix = len(os.path.commonprefix([new[prefix:][::-1], old[prefix:][::-1]]))
+    a = DIFF_TOKENS.findall(new[prefix:len(new) - suffix])
+    b = DIFF_TOKENS.findall(old[prefix:len(old) - suffix])
+    offsets = [prefix]
+    for token in a:
+        offsets.append(offsets[-1] + len(token))
+    
+    ops = [[0, prefix]] if prefix else []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if tag == 'equal':
+            ops.append([offsets[i1], offsets[i2]])
+        elif j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    if suffix:
+        ops.append([len(new) - suffix, len(new)])
+    return ops
+
+def apply_delta(new, ops):
+    return ''.join(new[op[0]:op[1]] if isinstance(op, list) else op for op in ops)
+
+def add_revision(db, entry_id, version, date, old_text, new_text):
+    """Keep `old_text` (replaced by `new_text`) as revision `version` of the entry"""
+    on_top = [row[0] for row in db.execute(
+        "SELECT is_snapshot FROM entry_revisions WHERE entry_id = ? ORDER BY version DESC LIMIT ?",
+        (entry_id, REVISION_SNAPSHOT_EVERY - 1)
+    )]
+    data, is_snapshot = zlib.compress(old_text.encode('utf-8'), 9), 1
+    if len(on_top) < REVISION_SNAPSHOT_EVERY - 1 or any(on_top):
+        delta = zlib.compress(json.dumps(text_delta(new_text, old_text), separators=(',', ':'),
+                                         ensure_ascii=False).encode('utf-8'), 9)
+        # A rewrite can make the delta bigger than the text itself
+        if len(delta) < len(data):
+            data, is_snapshot = delta, 0
+    
+    db.execute(
+        "INSERT INTO entry_revisions (entry_id, version, date, word_count, is_snapshot, data) VALUES (?, ?, ?, ?, ?, ?)",
+        (entry_id, version, date, len(old_text.split()), is_snapshot, data)
+    )
+    # Rebuilding only ever walks down from newer versions, so the oldest can go freely
+    if REVISION_KEEP:
+        db.execute("DELETE FROM entry_revisions WHERE entry_id = ? AND version <= ?", (entry_id, version - REVISION_KEEP))
+
+def list_revisions(db, entry_id):
+    return db.execute(
+        "SELECT version, date, word_count, saved_at FROM entry_revisions WHERE entry_id = ? ORDER BY version DESC",
+        (entry_id,)
+    ).fetchall()
+
+def get_revision_content(db, entry, version):
+    """The text of `entry` (a decoded entry row) at an earlier version, or None if that revision isn't kept"""
+    # Walk down from the nearest snapshot at or above `version` (or from the current text if there's none)
+    rows = db.execute("""
+        SELECT version, is_snapshot, data FROM entry_revisions
+        WHERE entry_id = ? AND version >= ? AND version <= COALESCE(
+            (SELECT MIN(version) FROM entry_revisions WHERE entry_id = ? AND version >= ? AND is_snapshot = 1), ?)
+        ORDER BY version DESC
+    """, (entry['id'], version, entry['id'], version, entry['version'])).fetchall()
+    if not rows or rows[-1][0] != version:
+        return None
+    text = entry['content'] or ''
+    for _, is_snapshot, data in rows:
+        raw = zlib.decompress(data).decode('utf-8')
+        text = raw if is_snapshot else apply_delta(text, json.loads(raw))
+    return text
+
+def delete_old_revisions(db, days):
+    """Drop revisions replaced more than `days` ago; returns how many went"""
+    return db.execute(
+        "DELETE FROM entry_revisions WHERE saved_at < datetime('now', ?)",
+        (f"-{days} days",)
+    ).rowcount
+
+# ---------------- PHOTOS ----------------
+
+def get_entry_photos(db, entry_id):
+    return db.execute(
+        "SELECT * FROM photos WHERE entry_id = ? ORDER BY id",
+        (entry_id,)
+    ).fetchall()
+
+def get_photos_for_entries(db, entry_ids):
+    """Photo filenames for many entries in one query, as {entry_id: [filename, ...]}"""
+    photos = {entry_id: [] for entry_id in entry_ids}
+    if entry_ids:
+        placeholders = ", ".join("?" * len(entry_ids))
+        for row in db.execute(f"SELECT entry_id, filename FROM photos WHERE entry_id IN ({placeholders}) ORDER BY id",
+                              list(entry_ids)):
+            photos[row['entry_id']].append(row['filename'])
+    return photos
+
+def get_photos_by_ids(db, user_id, photo_ids):
+    """Batch-load a user's photos by id"""
+    if not photo_ids:
+        return []
+    placeholders = ", ".join("?" * len(photo_ids))
+    return db.execute(f"""
+        SELECT p.id, p.entry_id, p.filename FROM photos p
+        JOIN entries e ON e.id = p.entry_id
+        WHERE e.user_id = ? AND p.id IN ({placeholders})
+    """, [user_id] + list(photo_ids)).fetchall()
+
+def add_photos(db, user_id, entry_id, photos):
+    """Attach (filename, size_bytes, width, height, placeholder) photos to an entry, only if the entry belongs to the user"""
+    db.executemany(
+        """INSERT INTO photos (entry_id, filename, size_bytes, width, height, placeholder)
+           SELECT id, ?, ?, ?, ?, ? FROM entries WHERE id = ? AND user_id = ?""",
+        [tuple(photo) + (entry_id, user_id) for photo in photos]
+    )
+
+def add_photos_by_source_ref(db, user_id, rows):
+    """Attach (filename, size_bytes, width, height, placeholder, source_ref, source_name) photos to imported entries
+    
+    A photo already attached under the same archive name is skipped, so re-running a batch adds
+    nothing twice; returns the filenames that were actually attached.
+    """
+    added = []
+    for row in rows:
+        inserted = db.execute(
+            """INSERT INTO photos (entry_id, filename, size_bytes, width, height, placeholder, source_name)
+               SELECT id, ?, ?, ?, ?, ?, ? FROM entries WHERE user_id = ? AND source_ref = ?
+               ON CONFLICT DO NOTHING
+               RETURNING filename""",
+            tuple(row[:5]) + (row[6], user_id, row[5])
+        ).fetchone()
+        if inserted:
+            added.append(inserted[0])
+    return added
+
+def delete_user_photos_batch(db, user_id, limit):
+    """Delete up to `limit` of a user's photo rows; returns the filenames that were removed"""
+    return [row[0] for row in db.execute("""
+        DELETE FROM photos WHERE id IN (
+            SELECT p.id FROM photos p JOIN entries e ON e.id = p.entry_id
+            WHERE e.user_id = ? LIMIT ?
+        ) RETURNING filename
+    """, (user_id, limit))]
+
+def get_unsized_photos(db, limit):
+    return db.execute("SELECT id, filename FROM photos WHERE size_bytes IS NULL LIMIT ?", (limit,)).fetchall()
+
+def set_photo_sizes(db, sizes):
+    """Record (size_bytes, photo_id) pairs"""
+    db.executemany("UPDATE photos SET size_bytes = ? WHERE id = ?", sizes)
+
+def get_unpreviewed_photos(db, after_id, limit):
+    return db.execute(
+        "SELECT id, filename FROM photos WHERE width IS NULL AND id > ? ORDER BY id LIMIT ?",
+        (after_id, limit)
+    ).fetchall()
+
+def set_photo_previews(db, previews):
+    """Record (width, height, placeholder, photo_id) tuples"""
+    db.executemany("UPDATE photos SET width = ?, height = ?, placeholder = ? WHERE id = ?", previews)
+
+# ---------------- DRAFTS ----------------
+
+# One autosaved draft per user and entry (entry_id 0 is the not-yet-saved new entry)
+
+def get_draft(db, user_id, entry_id):
+    row = db.execute(
+        "SELECT * FROM drafts WHERE user_id = ? AND entry_id = ?",
+        (user_id, entry_id)
+    ).fetchone()
+    return dict(row) if row else None
+
+def save_draft(db, user_id, entry_id, date, content, base_version):
+    """Create or overwrite a draft; returns its new version, or None if the entry isn't the user's"""
+    row = db.execute("""
+        INSERT INTO drafts (user_id, entry_id, date, content, base_version)
+        SELECT ?, ?, ?, ?, ?
+        WHERE ? = 0 OR EXISTS (SELECT 1 FROM entries WHERE id = ? AND user_id = ?)
+        ON CONFLICT(user_id, entry_id) DO UPDATE SET
+            date = excluded.date, content = excluded.content, base_version = excluded.base_version,
+            version = drafts.version + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING version
+    """, (user_id, entry_id, date, content, base_version, entry_id, entry_id, user_id)).fetchone()
+    return row[0] if row else None
+
+def delete_draft(db, user_id, entry_id):
+    db.execute("DELETE FROM drafts WHERE user_id = ? AND entry_id = ?", (user_id, entry_id))
+
+def delete_stale_drafts(db, days):
+    """Drop drafts nobody has touched for `days`; returns how many went"""
+    return db.execute(
+        "DELETE FROM drafts WHERE updated_at < datetime('now', ?)",
+        (f"-{days} days",)
+    ).rowcount
+
+# ---------------- IMPORT JOBS ----------------
+
+def create_import(db, user_id, archive_path, original_name):
+    return db.execute(
+        "INSERT INTO imports (user_id, archive_path, original_name) VALUES (?, ?, ?)",
+        (user_id, archive_path, original_name)
+    ).lastrowid
+
+def get_import(db, import_id, user_id=None):
+    if user_id is None:
+        return db.execute("SELECT * FROM imports WHERE id = ?", (import_id,)).fetchone()
+    return db.execute("SELECT * FROM imports WHERE id = ? AND user_id = ?", (import_id, user_id)).fetchone()
+
+def list_imports(db, user_id, stale_seconds):
+    """A user's import jobs, newest first; `stale` marks running jobs whose worker stopped checking in"""
+    return db.execute("""
+        SELECT *, (status = 'running' AND (heartbeat IS NULL OR heartbeat < datetime('now', ?))) AS stale
+        FROM imports WHERE user_id = ? ORDER BY id DESC
+    """, (f"-{stale_seconds} seconds", user_id)).fetchall()
+
+def claim_import(db, import_id, stale_seconds):
+    """Mark a job as running here unless it is done or another worker is running it; returns whether it was claimed"""
+    return db.execute("""
+        UPDATE imports SET status = 'running', error = NULL, heartbeat = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status != 'done'
+          AND (status != 'running' OR heartbeat IS NULL OR heartbeat < datetime('now', ?))
+    """, (import_id, f"-{stale_seconds} seconds")).rowcount > 0
+
+def touch_import(db, import_id):
+    db.execute("UPDATE imports SET heartbeat = CURRENT_TIMESTAMP WHERE id = ?", (import_id,))
+
+def set_import_status(db, import_id, status, error=None):
+    db.execute(
+        "UPDATE imports SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (status, error, import_id)
+    )
+
+def record_import_progress(db, import_id, lines_done, entries_added, photos_added):
+    db.execute("""
+        UPDATE imports
+        SET lines_done = ?, entries_imported = entries_imported + ?,
+            photos_imported = photos_imported + ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (lines_done, entries_added, photos_added, import_id))
+
+# ---------------- SYNC ----------------
+
+def get_tombstone_floor(db):
+    row = db.execute("SELECT value FROM sync_meta WHERE key = 'tombstone_floor'").fetchone()
+    return row['value'] if row else 0
+
+def get_changes_since(db, user_id, cursor, limit):
+    return db.execute("""
+        SELECT seq, kind, object_id, deleted FROM changes
+        WHERE user_id = ? AND seq > ?
+        ORDER BY seq
+        LIMIT ?
+    """, (user_id, cursor, limit)).fetchall()
+
+def prune_tombstones(db, days):
+    """Forget deletions older than `days`; returns the new floor (or None if nothing was pruned)"""
+    floor = db.execute(
+        "SELECT MAX(seq) FROM changes WHERE deleted = 1 AND changed_at < datetime('now', ?)",
+        (f"-{days} days",)
+    ).fetchone()[0]
+    if floor:
+        db.execute("DELETE FROM changes WHERE deleted = 1 AND seq <= ?", (floor,))
+        db.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES ('tombstone_floor', ?)", (floor,))
+    return floor
@@ -0,0 +1,18 @@
+let deleteUserId = null;
+
+function showDeleteModal(userId, username) {
+    deleteUserId = userId;
+    document.getElementById('deleteMessage').innerHTML = `Are you sure you want to delete user <strong>${username}</strong>? This will delete all their entries and photos.`;
+    document.getElementById('deleteModal').style.display = 'flex';
+}
+
+function hideDeleteModal() {
+    document.getElementById('deleteModal').style.display = 'none';
+    deleteUserId = null;
+}
+
+function confirmDelete() {
+    if (deleteUserId) {
+        window.location.href = '/admin_delete/' + deleteUserId;
+    }
+}
@@ -0,0 +1,142 @@
+// Autosaves the entry form as a server-side draft. Saves wait for a pause in typing (but no longer than
+// MAX_WAIT_MS while typing goes on), and once the server holds a copy only the changed span is sent.
+const IDLE_MS = 2000;
+const MAX_WAIT_MS = 15000;
+
+const draftForm = document.querySelector('form[data-draft-url]');
+
+if (draftForm) {
+    const url = draftForm.dataset.draftUrl;
+    const content = draftForm.elements.content;
+    const date = draftForm.elements.date;
+    const baseVersion = draftForm.elements.version ? parseInt(draftForm.elements.version.value, 10) : null;
+
+    // What the server's draft holds; version 0 means there is nothing this page can diff against yet
+    let saved = {version: 0, content: content.value, date: date.value};
+    let idleTimer = null;
+    let firstChange = null;
+    let inflight = null;
+    let stopped = false;
+
+    // One splice covering everything between the common prefix and suffix, in code points like the server
+    function textDiff(before, after) {
+        const a = Array.from(before);
+        const b = Array.from(after);
+        let start = 0;
+        while (start < a.length && start < b.length && a[start] === b[start]) {
+            start++;
+        }
+        let endA = a.length;
+        let endB = b.length;
+        while (endA > start && endB > start && a[endA - 1] === b[endB - 1]) {
+            endA--;
+            endB--;
+        }
+        return [[start, endA, b.slice(start, endB).join('')]];
+    }
+
+    function dirty() {
+        return content.value !== saved.content || date.value !== saved.date;
+    }
+
+    function schedule() {
+        if (stopped) {
+            return;
+        }
+        const now = Date.now();
+        firstChange = firstChange || now;
+        clearTimeout(idleTimer);
+        idleTimer = setTimeout(save, Math.min(IDLE_MS, firstChange + MAX_WAIT_MS - now));
+    }
+
+    function save(keepalive) {
+        clearTimeout(idleTimer);
+        idleTimer = null;
+        firstChange = null;
+        // A save already on the wire reschedules itself when it lands
+        if (inflight || !dirty()) {
+            return;
+        }
+
+        const text = content.value;
+        const day = date.value;
+        const body = {date: day, base_version: baseVersion};
+        if (saved.version) {
+            body.version = saved.version;
+            body.diff = textDiff(saved.content, text);
+        } else {
+            body.content = text;
+        }
+
+        let retry = false;
+        inflight = fetch(url, {
+            method: 'PATCH',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(body),
+            credentials: 'same-origin',
+            keepalive: keepalive === true,
+        }).then(response => {
+            if (response.ok) {
+                return response.json().then(result => {
+                    saved = {version: result.version, content: text, date: day};
+                    retry = true;
+                });
+            }
+            // 409: the server's copy isn't the one this page diffed against, so send the whole text
+            saved.version = 0;
+            retry = response.status === 409;
+        }, () => {
+            // Offline: the next edit (or the connection coming back) tries again in full
+            saved.version = 0;
+        }).then(() => {
+            inflight = null;
+            if (retry && dirty()) {
+                schedule();
+            }
+        });
+    }
+
+    content.addEventListener('input', schedule);
+    date.addEventListener('change', schedule);
+    window.addEventListener('online', schedule);
+    // Hiding the page may be the last chance we get (mobile browsers kill background tabs)
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden' && !stopped) {
+            save(true);
+        }
+    });
+
+    // Publishing goes through the normal form post, which deletes the draft; an autosave still on
+    // the wire must land first so it can't bring the draft back afterwards
+    draftForm.addEventListener('submit', event => {
+        if (stopped) {
+            event.preventDefault();
+            return;
+        }
+        stopped = true;
+        clearTimeout(idleTimer);
+        if (inflight) {
+            event.preventDefault();
+            inflight.then(() => draftForm.submit());
+        }
+    });
+
+    // Coming back to the form from the back/forward cache picks autosaving up again
+    window.addEventListener('pageshow', event => {
+        if (event.persisted) {
+            stopped = false;
+        }
+    });
+
+    const discard = document.querySelector('[data-draft-discard]');
+    if (discard) {
+        discard.addEventListener('click', () => {
+            stopped = true;
+            clearTimeout(idleTimer);
+            const reload = () => window.location.reload();
+            Promise.resolve(inflight)
+                .then(() => fetch(url, {method: 'DELETE', credentials: 'same-origin'}))
+                .then(reload, reload);
+        });
+    }
+}
@@ -0,0 +1,76 @@
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register('/sw.js');
+
+    // Browsers without Background Sync replay queued writes whenever a page loads or the connection returns
+    function replayOutbox() {
+        navigator.serviceWorker.ready.then(function(registration) {
+            if (registration.active && navigator.onLine) {
+                registration.active.postMessage('replay-outbox');
+            }
+        });
+    }
+    window.addEventListener('online', replayOutbox);
+    replayOutbox();
+
+    // Same as in sw.js: keep the two versions of this in step
+    function openOutbox() {
+        return new Promise(function(resolve, reject) {
+            var open = indexedDB.open('diary-outbox', 2);
+            open.onupgradeneeded = function() {
+                var db = open.result;
+                if (!db.objectStoreNames.contains('writes')) {
+                    db.createObjectStore('writes', {keyPath: 'id', autoIncrement: true});
+                }
+                if (!db.objectStoreNames.contains('conflicts')) {
+                    db.createObjectStore('conflicts', {keyPath: 'url'});
+                }
+            };
+            open.onsuccess = function() { resolve(open.result); };
+            open.onerror = function() { reject(open.error); };
+        });
+    }
+
+    // Offline edits that met a newer version of their entry were kept as drafts; point the user at them
+    function showConflicts() {
+        openOutbox().then(function(db) {
+            var store = db.transaction('conflicts', 'readwrite').objectStore('conflicts');
+            // Opening the entry's edit page restores the draft there, which settles it
+            store.delete(location.pathname);
+            store.getAll().onsuccess = function(event) {
+                renderConflicts(event.target.result);
+            };
+        });
+    }
+
+    function renderConflicts(conflicts) {
+        var old = document.getElementById('outbox-conflicts');
+        if (old) {
+            old.remove();
+        }
+        if (!conflicts.length) {
+            return;
+        }
+        var banner = document.createElement('div');
+        banner.id = 'outbox-conflicts';
+        banner.style.cssText = 'position: fixed; top: 10px; left: 10px; right: 10px; z-index: 2000; padding: 12px 15px;' +
+            'border-radius: 10px; background: #fefcbf; color: #744210; border: 1px solid #f6e05e; font-size: 14px;';
+        var photos = conflicts.some(function(conflict) { return conflict.photos; });
+        banner.textContent = 'An entry you edited offline was changed elsewhere in the meantime. Your version was kept ' +
+            'as a draft' + (photos ? ' (its photos need to be added again)' : '') + ': ';
+        conflicts.forEach(function(conflict, index) {
+            var link = document.createElement('a');
+            link.href = conflict.url;
+            link.textContent = conflicts.length > 1 ? 'review #' + (index + 1) : 'review it';
+            link.style.cssText = 'color: inherit; font-weight: 600; margin-right: 10px;';
+            banner.appendChild(link);
+        });
+        document.body.appendChild(banner);
+    }
+
+    navigator.serviceWorker.addEventListener('message', function(event) {
+        if (event.data === 'outbox-conflict') {
+            showConflicts();
+        }
+    });
+    showConflicts();
+}
@@ -0,0 +1,228 @@
+// Served at /sw.js; the app fills in the cache version and the precache list below
+const VERSION = '__VERSION__';
+const SHELL_CACHE = 'diary-shell-' + VERSION;
+const PAGE_CACHE = 'diary-pages';
+const PHOTO_CACHE = 'diary-photos';
+const PRECACHE = __PRECACHE__;
+const MAX_PAGES = 50;
+const MAX_PHOTOS = 100;
+
+// Reading pages kept for offline use, and the form posts that are queued when offline
+const CACHED_PAGES = /^\/(entries|view\/\d+)$/;
+const QUEUED_WRITES = /^\/(save|update\/\d+)$/;
+// Replay and forget the previous account's data before the session changes hands
+const ACCOUNT_SWITCHES = /^\/(logout|admin_login\/\d+)$/;
+// A session that expired without a logout leaves those behind, so signing in clears them too
+const SIGN_INS = /^\/(login|signup)$/;
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(PRECACHE))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys
+                .filter(key => key.startsWith('diary-shell-') && key !== SHELL_CACHE)
+                .map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) {
+        return;
+    }
+
+    if (request.method === 'POST' && QUEUED_WRITES.test(url.pathname)) {
+        event.respondWith(postOrQueue(request));
+    } else if (request.method === 'POST' && SIGN_INS.test(url.pathname)) {
+        event.respondWith(switchAccount(request));
+    } else if (request.method !== 'GET') {
+        return;
+    } else if (ACCOUNT_SWITCHES.test(url.pathname)) {
+        event.respondWith(switchAccount(request));
+    } else if (url.pathname.startsWith('/assets/')) {
+        event.respondWith(cacheFirst(request, SHELL_CACHE));
+    } else if (url.pathname.startsWith('/uploads/')) {
+        event.respondWith(cacheFirst(request, PHOTO_CACHE, MAX_PHOTOS));
+    } else if (request.mode === 'navigate') {
+        event.respondWith(networkFirst(request, CACHED_PAGES.test(url.pathname)));
+    }
+});
+
+self.addEventListener('sync', event => {
+    if (event.tag === 'diary-outbox') {
+        event.waitUntil(replayOutbox());
+    }
+});
+
+self.addEventListener('message', event => {
+    if (event.data === 'replay-outbox') {
+        event.waitUntil(replayOutbox().catch(() => {}));
+    }
+});
+
+// ---------------- CACHING ----------------
+
+function trimCache(name, max) {
+    return caches.open(name).then(cache => cache.keys().then(keys =>
+        Promise.all(keys.slice(0, Math.max(keys.length - max, 0)).map(key => cache.delete(key)))));
+}
+
+function cacheFirst(request, cacheName, max) {
+    return caches.open(cacheName).then(cache => cache.match(request).then(cached => {
+        if (cached) {
+            return cached;
+        }
+        return fetch(request).then(response => {
+            if (response.ok) {
+                cache.put(request, response.clone()).then(() => max && trimCache(cacheName, max));
+            }
+            return response;
+        });
+    }));
+}
+
+function networkFirst(request, keep) {
+    return fetch(request).then(response => {
+        if (keep && response.ok && response.type === 'basic') {
+            const copy = response.clone();
+            caches.open(PAGE_CACHE)
+                .then(cache => cache.delete(request).then(() => cache.put(request, copy)))
+                .then(() => trimCache(PAGE_CACHE, MAX_PAGES));
+        }
+        return response;
+    }).catch(() => caches.match(request, {ignoreVary: true})
+        .then(cached => cached || caches.match('/offline')));
+}
+
+function switchAccount(request) {
+    return replayOutbox().catch(() => {})
+        .then(() => Promise.all([caches.delete(PAGE_CACHE), caches.delete(PHOTO_CACHE)]))
+        .then(() => fetch(request))
+        .catch(() => caches.match('/offline'));
+}
+
+// ---------------- OUTBOX ----------------
+
+// Shared with pwa.js, which reads the conflicts store: keep the two versions of this in step
+function openOutbox() {
+    return new Promise((resolve, reject) => {
+        const open = indexedDB.open('diary-outbox', 2);
+        open.onupgradeneeded = () => {
+            const db = open.result;
+            if (!db.objectStoreNames.contains('writes')) {
+                db.createObjectStore('writes', {keyPath: 'id', autoIncrement: true});
+            }
+            if (!db.objectStoreNames.contains('conflicts')) {
+                db.createObjectStore('conflicts', {keyPath: 'url'});
+            }
+        };
+        open.onsuccess = () => resolve(open.result);
+        open.onerror = () => reject(open.error);
+    });
+}
+
+function outbox(mode, action) {
+    return openOutbox().then(db => new Promise((resolve, reject) => {
+        const tx = db.transaction('writes', mode);
+        const result = action(tx.objectStore('writes'));
+        tx.oncomplete = () => resolve(result.result);
+        tx.onerror = () => reject(tx.error);
+    }));
+}
+
+function postOrQueue(request) {
+    const copy = request.clone();
+    return fetch(request).catch(() => copy.formData()
+        // FormData can't be stored, but its string and File values can
+        .then(form => outbox('readwrite', store => store.add({
+            url: copy.url,
+            // Includes the form's account field, which the server checks against the session on replay
+            fields: Array.from(form.entries()),
+            queuedAt: Date.now(),
+        })))
+        .then(() => self.registration.sync ? self.registration.sync.register('diary-outbox').catch(() => {}) : null)
+        .then(() => caches.match('/offline?queued=1')));
+}
+
+let replaying = null;
+
+function replayOutbox() {
+    // One replay at a time, so a write is never sent twice
+    if (!replaying) {
+        replaying = outbox('readonly', store => store.getAll())
+            .then(writes => writes.reduce((previous, write) => previous.then(() => replayWrite(write)), Promise.resolve()))
+            .finally(() => { replaying = null; });
+    }
+    return replaying;
+}
+
+// Where an accepted write ends up: /save answers in place, /update/<id> redirects to the entry
+function acceptedPath(write) {
+    const path = new URL(write.url).pathname;
+    return path.startsWith('/update/') ? '/view/' + path.split('/').pop() : path;
+}
+
+function replayWrite(write) {
+    const body = new FormData();
+    write.fields.forEach(([name, value]) => body.append(name, value));
+    return fetch(write.url, {method: 'POST', body: body, credentials: 'same-origin'}).then(response => {
+        // 409: the entry was saved elsewhere since it was edited offline, so resending can never succeed
+        if (response.status === 409) {
+            return keepAsDraft(write);
+        }
+        // 403: queued by another account than the one signed in now; hold it until that account is back,
+        // but let this account's own writes through meanwhile
+        if (response.status === 403) {
+            return;
+        }
+        // Anything else but the expected page (the login page after the session expired, the entry list
+        // for an entry that isn't there) means the write didn't land; keep it
+        if (!response.ok || new URL(response.url).pathname !== acceptedPath(write)) {
+            throw new Error('write not accepted yet');
+        }
+        return outbox('readwrite', store => store.delete(write.id));
+    });
+}
+
+// The offline edit becomes the entry's draft (which its edit page restores), and the user is told
+function keepAsDraft(write) {
+    const fields = new Map(write.fields.filter(([, value]) => typeof value === 'string'));
+    const entryId = new URL(write.url).pathname.split('/').pop();
+    const version = parseInt(fields.get('version'), 10);
+    return fetch('/api/v1/drafts/' + entryId, {
+        method: 'PATCH',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+            date: fields.get('date'),
+            content: fields.get('content') || '',
+            base_version: isNaN(version) ? null : version,
+        }),
+        credentials: 'same-origin',
+    }).then(response => {
+        if (!response.ok) {
+            throw new Error('draft not saved yet');
+        }
+        const conflict = {
+            url: '/edit/' + entryId,
+            photos: write.fields.some(([, value]) => typeof value !== 'string' && value.size > 0),
+            at: Date.now(),
+        };
+        return openOutbox().then(db => new Promise((resolve, reject) => {
+            const tx = db.transaction(['writes', 'conflicts'], 'readwrite');
+            tx.objectStore('writes').delete(write.id);
+            tx.objectStore('conflicts').put(conflict);
+            tx.oncomplete = () => resolve();
+            tx.onerror = () => reject(tx.error);
+        }));
+    }).then(() => self.clients.matchAll({type: 'window'}))
+        .then(clients => clients.forEach(client => client.postMessage('outbox-conflict')));
+}
@@ -0,0 +1,11 @@
+function showDeleteModal() {
+    document.getElementById('deleteModal').style.display = 'flex';
+}
+
+function hideDeleteModal() {
+    document.getElementById('deleteModal').style.display = 'none';
+}
+
+function deleteEntry() {
+    window.location.href = document.getElementById('deleteModal').dataset.deleteUrl;
+}